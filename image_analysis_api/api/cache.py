@@ -0,0 +1,136 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import hashlib
+import time
+from typing import Dict, Generic, Hashable, List, Mapping, NamedTuple, Tuple, TypeVar
+
+from image_analysis_api.api.models import AnalyzedImage
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    def __init__(self, maxsize: int, ttl: float | None = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict[Hashable, Tuple[float, V]] = OrderedDict()
+
+    def get(self, key: Hashable) -> V | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: V) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl else float("inf")
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self.entries.pop(key, None)
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    async def get(self, key: str) -> bytes | None:
+        ...
+
+    @abstractmethod
+    async def set_many(self, items: Dict[str, bytes]) -> None:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemoryCacheBackend(CacheBackend):
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.cache: LRUCache[bytes] = LRUCache(maxsize, ttl)
+
+    async def get(self, key: str) -> bytes | None:
+        return self.cache.get(key)
+
+    async def set_many(self, items: Dict[str, bytes]) -> None:
+        for key, value in items.items():
+            self.cache.set(key, value)
+
+
+class RedisCacheBackend(CacheBackend):
+    def __init__(self, url: str, ttl: float) -> None:
+        # redis is an optional dependency, only needed for a shared cache.
+        from redis.asyncio import Redis
+
+        self.client = Redis.from_url(url)
+        self.ttl = int(ttl)
+
+    async def get(self, key: str) -> bytes | None:
+        return await self.client.get(key)
+
+    async def set_many(self, items: Dict[str, bytes]) -> None:
+        async with self.client.pipeline(transaction=False) as pipeline:
+            for key, value in items.items():
+                pipeline.set(key, value, ex=self.ttl)
+            await pipeline.execute()
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+class CachedImage(NamedTuple):
+    etag: str
+    body: bytes
+
+
+class ImageResponseCache:
+    def __init__(self, backend: CacheBackend) -> None:
+        self.backend = backend
+
+    async def get(self, image_id: int) -> CachedImage | None:
+        entry = await self.backend.get(self.key(image_id))
+        if entry is None:
+            return None
+
+        etag, body = entry.split(b"\n", 1)
+        return CachedImage(etag.decode("ascii"), body)
+
+    async def set(self, image: Mapping) -> CachedImage:
+        cached_images = await self.set_many([image])
+        return cached_images[0]
+
+    async def set_many(self, images: List[Mapping]) -> List[CachedImage]:
+        cached_images = {}
+        for image in images:
+            body = AnalyzedImage.parse_obj(image).json().encode("utf-8")
+            etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+            cached_images[self.key(image["id"])] = CachedImage(etag, body)
+
+        await self.backend.set_many(
+            {
+                key: cached_image.etag.encode("ascii") + b"\n" + cached_image.body
+                for key, cached_image in cached_images.items()
+            }
+        )
+        return list(cached_images.values())
+
+    def key(self, image_id: int) -> str:
+        return f"image:{image_id}"
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if if_none_match is None:
+        return False
+
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
@@ -1,23 +1,118 @@
 from functools import lru_cache
-from pydantic import BaseSettings
+from typing import Dict, Literal
+from pydantic import BaseSettings, root_validator
 from decimal import Decimal
 
 
 class ImageAnalysisConfig(BaseSettings):
-    azure_cs_api_key: str
-    azure_cs_endpoint: str
-    azure_cs_region: str
-    azure_storage_connection_string: str
+    azure_cs_api_key: str | None = None
+    azure_cs_endpoint: str | None = None
+    azure_cs_region: str | None = None
+    azure_storage_connection_string: str | None = None
     postgres_connection_string: str
+    create_schema_on_startup: bool = False
     acceptable_confidence_score: str
+    detection_min_confidence: str = "0.1"
+    http_max_connections: int = 100
+    http_max_connections_per_host: int = 10
+    http_connect_timeout: float = 5.0
+    http_read_timeout: float = 30.0
+    http_total_timeout: float = 60.0
+    analysis_executor_max_workers: int = 64
+    content_hash_cache_size: int = 10000
+    image_cache_backend: Literal["memory", "redis"] = "memory"
+    image_cache_size: int = 10000
+    image_cache_ttl: float = 3600
+    image_cache_redis_url: str | None = None
+    image_cache_max_age: int = 86400
+    analysis_max_dimension: int = 1024
+    analysis_jpeg_quality: int = 85
+    preprocessing_max_workers: int = 4
+    image_derivatives: Dict[str, int] = {"thumbnail": 256, "preview": 1024}
+    image_derivative_format: Literal["webp", "jpeg"] = "webp"
+    image_derivative_quality: int = 80
+    derivative_process_workers: int = 2
+    batch_max_items: int = 1000
+    batch_max_concurrency: int = 16
+    images_page_default_limit: int = 100
+    images_page_max_limit: int = 1000
+    export_chunk_size: int = 64 * 1024
+    export_settle_seconds: float = 30.0
+    similarity_index_refresh_interval: float = 5.0
+    similarity_index_refresh_overlap: int = 10000
+    job_workers: int = 4
+    job_poll_interval: float = 1.0
+    job_lease_seconds: int = 300
+    job_max_attempts: int = 3
+    server_timing: bool = False
+    storage_backend: Literal["azure", "local"] = "azure"
+    local_storage_path: str = "images"
+    local_storage_url: str | None = None
+    local_storage_max_workers: int = 8
+    image_content_max_age: int = 31536000
+    analyzer_backend: Literal["azure", "local"] = "azure"
+    local_model_path: str | None = None
+    local_model_labels_path: str | None = None
+    local_model_input_size: int = 224
+    local_model_workers: int = 1
+    analysis_batch_max_size: int = 16
+    analysis_batch_max_wait: float = 0.01
+    analysis_timeout: float = 10.0
+    storage_timeout: float = 10.0
+    dependency_max_attempts: int = 3
+    dependency_backoff_base: float = 0.1
+    dependency_backoff_max: float = 2.0
+    dependency_hedge_percentile: float | None = None
+    dependency_hedge_min_samples: int = 100
+    circuit_failure_threshold: int = 5
+    circuit_reset_timeout: float = 30.0
+    analysis_rate_limit: float | None = None
+    analysis_rate_burst: int = 10
+    analysis_rate_limit_redis_url: str | None = None
+    analysis_concurrency_initial: int = 8
+    analysis_concurrency_min: int = 1
+    analysis_concurrency_max: int = 64
+    analysis_latency_tolerance: float = 2.0
+    analysis_admission_max_wait: float = 5.0
 
-    class Config:
-        env_file = ".env"
+    @root_validator
+    def validate_storage_backend(cls, values):
+        if values.get("storage_backend") == "azure" and not values.get(
+            "azure_storage_connection_string"
+        ):
+            raise ValueError(
+                "azure_storage_connection_string is required when storage_backend is azure"
+            )
+        return values
+
+    # Every admitted call holds an executor thread, so admitting more calls
+    # than there are threads would queue them locally. The limiter would take
+    # that queueing for Azure slowing down and back off.
+    @root_validator
+    def validate_analysis_concurrency(cls, values):
+        max_workers = values.get("analysis_executor_max_workers")
+        for name in ["analysis_concurrency_initial", "analysis_concurrency_max"]:
+            if values.get(name) is not None and max_workers is not None:
+                values[name] = min(values[name], max_workers)
+        return values
 
+    @root_validator
+    def validate_analyzer_backend(cls, values):
+        if values.get("analyzer_backend") == "azure":
+            required = ["azure_cs_api_key", "azure_cs_endpoint"]
+        else:
+            required = ["local_model_path", "local_model_labels_path"]
+        missing = [name for name in required if not values.get(name)]
+        if missing:
+            raise ValueError(
+                f"{', '.join(missing)} required when analyzer_backend is {values.get('analyzer_backend')}"
+            )
+        return values
 
-image_analysis_config = ImageAnalysisConfig()
+    class Config:
+        env_file = ".env"
 
 
 @lru_cache()
 def get_config() -> ImageAnalysisConfig:
-    return image_analysis_config
+    return ImageAnalysisConfig()
@@ -1,21 +1,24 @@
-from typing import List
+from functools import lru_cache
 
 import databases
 from sqlalchemy import (
     Table,
+    BigInteger,
     Column,
     Boolean,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
     MetaData,
     String,
     Integer,
-    create_engine,
+    func,
 )
-from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 
 from image_analysis_api.api.config import get_config
 
-config = get_config()
-database = databases.Database(config.postgres_connection_string)
 metadata = MetaData()
 
 images: Table = Table(
@@ -26,7 +29,70 @@ images: Table = Table(
     Column("url", String),
     Column("analyze_image", Boolean),
     Column("objects", ARRAY(String)),
+    Column("content_hash", String(64), index=True),
+    Column("derivatives", JSONB),
+    Column("blob_name", String),
+    Column("perceptual_hash", BigInteger),
+    Column("detections", JSONB),
+    Column(
+        "updated_at",
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        index=True,
+    ),
 )
 
-engine = create_engine(config.postgres_connection_string)
-metadata.create_all(engine)
+# One row per normalized object tag. The (tag, image_id) primary key is the
+# index used by tag searches and by the object counts in GET /objects.
+image_tags: Table = Table(
+    "image_tags",
+    metadata,
+    Column("tag", String, primary_key=True),
+    Column(
+        "image_id",
+        Integer,
+        ForeignKey("images.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+)
+
+# The highest confidence of each label detected in an image, from the stored
+# detections, so searches can use a different confidence than the one objects
+# were picked with. The (label, confidence) index serves those searches.
+image_labels: Table = Table(
+    "image_labels",
+    metadata,
+    Column(
+        "image_id",
+        Integer,
+        ForeignKey("images.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    Column("label", String, primary_key=True),
+    Column("confidence", Float, nullable=False),
+    Index("ix_image_labels_label_confidence", "label", "confidence", "image_id"),
+)
+
+jobs: Table = Table(
+    "jobs",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("status", String(20), nullable=False, index=True),
+    Column("request", JSONB, nullable=False),
+    Column("image_id", Integer, ForeignKey("images.id")),
+    Column("error", String),
+    Column("attempts", Integer, nullable=False, server_default="0"),
+    Column("claimed_at", DateTime(timezone=True)),
+    # Set on every claim, so only the worker holding the lease can renew it
+    # or record the job's outcome.
+    Column("lease_token", String(32)),
+    Column(
+        "created_at", DateTime(timezone=True), nullable=False, server_default=func.now()
+    ),
+)
+
+
+@lru_cache()
+def get_database() -> databases.Database:
+    return databases.Database(get_config().postgres_connection_string)
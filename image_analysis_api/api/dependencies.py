@@ -0,0 +1,334 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+from typing import Callable, Mapping
+
+from fastapi import Depends
+
+from image_analysis_api.api.cache import (
+    CacheBackend,
+    ImageResponseCache,
+    InMemoryCacheBackend,
+    LRUCache,
+    RedisCacheBackend,
+)
+from image_analysis_api.api.config import ImageAnalysisConfig, get_config
+from image_analysis_api.api.db import (
+    get_database,
+    image_labels,
+    image_tags,
+    images,
+    jobs,
+)
+from image_analysis_api.api.images_repo import ImageRepository
+from image_analysis_api.api.ingestion import ImageIngestionPipeline
+from image_analysis_api.api.job_workers import JobWorkerPool
+from image_analysis_api.api.jobs_repo import JobRepository
+from image_analysis_api.api.similarity_index import PerceptualHashIndex
+from image_analysis_api.services.admission import (
+    AdmissionController,
+    AIMDLimiter,
+    InMemoryTokenBucket,
+    RedisTokenBucket,
+    TokenBucket,
+)
+from image_analysis_api.services.image_analysis_service import (
+    ImageAnalysisService,
+    is_overload_error,
+    is_transient_error,
+)
+from image_analysis_api.services.image_analyzers import ImageAnalyzer
+from image_analysis_api.services.image_download_service import ImageDownloadService
+from image_analysis_api.services.image_preprocessing_service import (
+    ImagePreprocessingService,
+)
+from image_analysis_api.services.image_storage_service import ImageStorageService
+from image_analysis_api.services.local_image_analyzer import (
+    LocalImageAnalyzer,
+    load_model,
+)
+from image_analysis_api.services.resilience import ResilientCaller, is_timeout
+from image_analysis_api.services.storage_backends import (
+    AzureBlobStorageBackend,
+    LocalStorageBackend,
+    StorageBackend,
+    is_transient_blob_error,
+)
+
+# Worker processes are started fresh instead of forked, since forking copies
+# the event loop, open sockets and locks held by other threads.
+worker_process_context = multiprocessing.get_context("spawn")
+
+
+class AppServices:
+    def __init__(self, config: ImageAnalysisConfig) -> None:
+        self.content_hash_cache: LRUCache[Mapping] = LRUCache(
+            maxsize=config.content_hash_cache_size
+        )
+        self.image_cache_backend = create_cache_backend(config)
+        self.image_cache = ImageResponseCache(self.image_cache_backend)
+        self.similarity_index = PerceptualHashIndex(
+            config.similarity_index_refresh_interval,
+            config.similarity_index_refresh_overlap,
+        )
+        self.image_download_service = ImageDownloadService(
+            max_connections=config.http_max_connections,
+            max_connections_per_host=config.http_max_connections_per_host,
+            connect_timeout=config.http_connect_timeout,
+            read_timeout=config.http_read_timeout,
+            total_timeout=config.http_total_timeout,
+        )
+
+        self.preprocessing_executor = ThreadPoolExecutor(
+            max_workers=config.preprocessing_max_workers,
+            thread_name_prefix="image-preprocessing",
+        )
+        self.image_preprocessing_service = ImagePreprocessingService(
+            config.analysis_max_dimension,
+            config.analysis_jpeg_quality,
+            self.preprocessing_executor,
+        )
+
+        self.analysis_executor: Executor
+        self.image_analysis_service: ImageAnalyzer
+        self.analysis_admission: AdmissionController | None = None
+        if config.analyzer_backend == "local":
+            self.analysis_executor = ProcessPoolExecutor(
+                max_workers=config.local_model_workers,
+                mp_context=worker_process_context,
+                initializer=load_model,
+                initargs=(config.local_model_path, config.local_model_labels_path),
+            )
+            self.image_analysis_service = LocalImageAnalyzer(
+                config.local_model_input_size,
+                config.analysis_batch_max_size,
+                config.analysis_batch_max_wait,
+                config.local_model_workers,
+                self.analysis_executor,
+            )
+        else:
+            self.analysis_executor = ThreadPoolExecutor(
+                max_workers=config.analysis_executor_max_workers,
+                thread_name_prefix="image-analysis",
+            )
+            self.analysis_admission = create_analysis_admission(config)
+            self.image_analysis_service = ImageAnalysisService(
+                config.azure_cs_endpoint,
+                config.azure_cs_api_key,
+                self.analysis_executor,
+                create_resilient_caller(
+                    config,
+                    "computer_vision",
+                    config.analysis_timeout,
+                    is_transient_error,
+                    self.analysis_admission,
+                ),
+            )
+        self.derivative_executor = ProcessPoolExecutor(
+            max_workers=config.derivative_process_workers,
+            mp_context=worker_process_context,
+        )
+        self.storage_executor = ThreadPoolExecutor(
+            max_workers=config.local_storage_max_workers,
+            thread_name_prefix="local-storage",
+        )
+        self.image_storage_service = ImageStorageService(
+            create_storage_backend(config, self.storage_executor),
+            config.image_derivatives,
+            config.image_derivative_format,
+            config.image_derivative_quality,
+            self.derivative_executor,
+            create_resilient_caller(
+                config,
+                f"{config.storage_backend}_storage",
+                config.storage_timeout,
+                is_transient_blob_error
+                if config.storage_backend == "azure"
+                else is_timeout,
+            ),
+        )
+
+        self.job_worker_pool = JobWorkerPool(
+            get_job_repository(),
+            create_ingestion_pipeline,
+            workers=config.job_workers,
+            poll_interval=config.job_poll_interval,
+            lease_seconds=config.job_lease_seconds,
+            max_attempts=config.job_max_attempts,
+        )
+
+    async def open(self) -> None:
+        await self.image_download_service.open()
+
+    async def close(self) -> None:
+        await self.image_download_service.close()
+        await self.image_storage_service.close()
+        await self.image_cache_backend.close()
+        self.image_analysis_service.close()
+        if self.analysis_admission is not None:
+            await self.analysis_admission.close()
+        self.analysis_executor.shutdown(wait=True)
+        self.preprocessing_executor.shutdown(wait=True)
+        self.derivative_executor.shutdown(wait=True)
+        self.storage_executor.shutdown(wait=True)
+
+
+def create_cache_backend(config: ImageAnalysisConfig) -> CacheBackend:
+    if config.image_cache_backend == "redis":
+        return RedisCacheBackend(config.image_cache_redis_url, config.image_cache_ttl)
+    return InMemoryCacheBackend(config.image_cache_size, config.image_cache_ttl)
+
+
+def create_resilient_caller(
+    config: ImageAnalysisConfig,
+    name: str,
+    timeout: float,
+    is_transient: Callable[[BaseException], bool],
+    admission: AdmissionController | None = None,
+) -> ResilientCaller:
+    return ResilientCaller(
+        name,
+        timeout=timeout,
+        max_attempts=config.dependency_max_attempts,
+        backoff_base=config.dependency_backoff_base,
+        backoff_max=config.dependency_backoff_max,
+        hedge_percentile=config.dependency_hedge_percentile,
+        hedge_min_samples=config.dependency_hedge_min_samples,
+        circuit_failure_threshold=config.circuit_failure_threshold,
+        circuit_reset_timeout=config.circuit_reset_timeout,
+        is_transient=is_transient,
+        admission=admission,
+    )
+
+
+def create_analysis_admission(config: ImageAnalysisConfig) -> AdmissionController:
+    token_bucket: TokenBucket | None = None
+    if config.analysis_rate_limit and config.analysis_rate_limit_redis_url:
+        token_bucket = RedisTokenBucket(
+            config.analysis_rate_limit_redis_url,
+            "computer_vision:tokens",
+            config.analysis_rate_limit,
+            config.analysis_rate_burst,
+        )
+    elif config.analysis_rate_limit:
+        token_bucket = InMemoryTokenBucket(
+            config.analysis_rate_limit, config.analysis_rate_burst
+        )
+
+    limiter = AIMDLimiter(
+        config.analysis_concurrency_initial,
+        config.analysis_concurrency_min,
+        config.analysis_concurrency_max,
+        config.analysis_latency_tolerance,
+    )
+    return AdmissionController(
+        limiter, token_bucket, config.analysis_admission_max_wait, is_overload_error
+    )
+
+
+def create_storage_backend(
+    config: ImageAnalysisConfig, executor: Executor
+) -> StorageBackend:
+    if config.storage_backend == "local":
+        return LocalStorageBackend(
+            config.local_storage_path, config.local_storage_url, executor
+        )
+    return AzureBlobStorageBackend(config.azure_storage_connection_string)
+
+
+services: AppServices | None = None
+
+
+async def open_clients() -> None:
+    global services
+    services = AppServices(get_config())
+    await services.open()
+    await get_image_repository().refresh_similarity_index(force=True)
+
+
+async def close_clients() -> None:
+    if services is not None:
+        await services.close()
+
+
+async def start_job_workers() -> None:
+    services.job_worker_pool.start()
+
+
+async def stop_job_workers() -> None:
+    if services is not None:
+        await services.job_worker_pool.stop()
+
+
+def get_image_download_service() -> ImageDownloadService:
+    return services.image_download_service
+
+
+def get_image_preprocessing_service() -> ImagePreprocessingService:
+    return services.image_preprocessing_service
+
+
+def get_analysis_admission() -> AdmissionController | None:
+    return services.analysis_admission
+
+
+def get_image_analysis_service() -> ImageAnalyzer:
+    return services.image_analysis_service
+
+
+def get_image_storage_service() -> ImageStorageService:
+    return services.image_storage_service
+
+
+def get_storage_backend() -> StorageBackend:
+    return services.image_storage_service.backend
+
+
+def get_image_repository() -> ImageRepository:
+    return ImageRepository(
+        images,
+        image_tags,
+        image_labels,
+        get_database(),
+        services.content_hash_cache,
+        services.image_cache,
+        services.similarity_index,
+    )
+
+
+def get_job_repository() -> JobRepository:
+    return JobRepository(jobs, images, get_database())
+
+
+def get_job_worker_pool() -> JobWorkerPool:
+    return services.job_worker_pool
+
+
+def create_ingestion_pipeline() -> ImageIngestionPipeline:
+    return ImageIngestionPipeline(
+        get_config(),
+        services.image_download_service,
+        services.image_preprocessing_service,
+        services.image_analysis_service,
+        services.image_storage_service,
+        get_image_repository(),
+    )
+
+
+def get_ingestion_pipeline(
+    config: ImageAnalysisConfig = Depends(get_config),
+    image_download_service: ImageDownloadService = Depends(get_image_download_service),
+    image_preprocessing_service: ImagePreprocessingService = Depends(
+        get_image_preprocessing_service
+    ),
+    image_analysis_service: ImageAnalyzer = Depends(get_image_analysis_service),
+    image_storage_service: ImageStorageService = Depends(get_image_storage_service),
+    image_repo: ImageRepository = Depends(get_image_repository),
+) -> ImageIngestionPipeline:
+    return ImageIngestionPipeline(
+        config,
+        image_download_service,
+        image_preprocessing_service,
+        image_analysis_service,
+        image_storage_service,
+        image_repo,
+    )
@@ -0,0 +1,30 @@
+from datetime import datetime
+import json
+from typing import Any, AsyncIterator, List, Mapping
+
+from image_analysis_api.api.images_repo import row_to_dict
+
+
+def to_json_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+# Writes one JSON object per line, and sends lines in chunks of about
+# chunk_size bytes rather than one at a time.
+async def ndjson_chunks(
+    rows: AsyncIterator[Mapping], chunk_size: int
+) -> AsyncIterator[bytes]:
+    lines: List[str] = []
+    size = 0
+    async for row in rows:
+        line = json.dumps(row_to_dict(row), default=to_json_value) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield "".join(lines).encode("utf-8")
+            lines, size = [], 0
+
+    if lines:
+        yield "".join(lines).encode("utf-8")
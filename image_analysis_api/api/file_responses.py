@@ -0,0 +1,123 @@
+import os
+from typing import Mapping, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+# Returns the inclusive (start, end) byte range to send, or None for the whole
+# file. Multiple ranges are answered with the whole file, which RFC 9110 allows.
+def parse_byte_range(
+    range_header: str | None, file_size: int
+) -> Tuple[int, int] | None:
+    if range_header is None:
+        return None
+
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    first, _, last = ranges.strip().partition("-")
+    try:
+        if first == "":
+            suffix_length = int(last)
+            if suffix_length <= 0:
+                raise RangeNotSatisfiable()
+            start, end = max(file_size - suffix_length, 0), file_size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else file_size - 1
+    except ValueError:
+        return None
+
+    if start >= file_size:
+        raise RangeNotSatisfiable()
+    if start > end:
+        return None
+    return start, min(end, file_size - 1)
+
+
+# Serves a file, or one range of it, using the ASGI zero-copy extension when
+# the server supports it, so the file is sent with sendfile() instead of
+# being copied through Python. Other servers get the file in chunks.
+class RangeFileResponse(Response):
+    def __init__(
+        self,
+        path: str | os.PathLike,
+        file_size: int,
+        range_header: str | None,
+        media_type: str,
+        headers: Mapping[str, str],
+    ) -> None:
+        super().__init__(status_code=200, media_type=media_type, headers=headers)
+        self.path = path
+        self.raw_headers = [
+            (key, value) for key, value in self.raw_headers if key != b"content-length"
+        ]
+        self.headers["Accept-Ranges"] = "bytes"
+
+        try:
+            byte_range = parse_byte_range(range_header, file_size)
+        except RangeNotSatisfiable:
+            self.status_code = 416
+            self.headers["Content-Range"] = f"bytes */{file_size}"
+            self.headers["Content-Length"] = "0"
+            self.offset, self.count = 0, 0
+            return
+
+        if byte_range is None:
+            self.offset, self.count = 0, file_size
+        else:
+            start, end = byte_range
+            self.status_code = 206
+            self.headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+            self.offset, self.count = start, end - start + 1
+        self.headers["Content-Length"] = str(self.count)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if self.count == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        with open(self.path, "rb") as f:
+            if "http.response.zerocopy" in scope.get("extensions", {}):
+                await send(
+                    {
+                        "type": "http.response.zerocopy",
+                        "file": f,
+                        "offset": self.offset,
+                        "count": self.count,
+                    }
+                )
+                return
+
+            await run_in_threadpool(f.seek, self.offset)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await run_in_threadpool(f.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": remaining > 0,
+                    }
+                )
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b""})
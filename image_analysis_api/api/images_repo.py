@@ -1,37 +1,320 @@
-from typing import List, Mapping
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, Iterable, List, Mapping, Tuple
 from databases import Database
-from sqlalchemy import Table
+from sqlalchemy import Interval, Table, cast, func, select
+
+from image_analysis_api.api.cache import CachedImage, ImageResponseCache, LRUCache
+from image_analysis_api.api.metrics import track
+from image_analysis_api.api.models import TagMatch
+from image_analysis_api.api.similarity_index import PerceptualHashIndex
 
 
 class ImageRepository:
-    def __init__(self, images_table: Table, database: Database) -> None:
+    def __init__(
+        self,
+        images_table: Table,
+        image_tags_table: Table,
+        image_labels_table: Table,
+        database: Database,
+        content_hash_cache: LRUCache[Mapping],
+        image_cache: ImageResponseCache,
+        similarity_index: PerceptualHashIndex,
+    ) -> None:
         self.images_table = images_table
+        self.image_tags_table = image_tags_table
+        self.image_labels_table = image_labels_table
         self.database = database
+        self.content_hash_cache = content_hash_cache
+        self.image_cache = image_cache
+        self.similarity_index = similarity_index
 
     async def get_image(self, image_id: int) -> Mapping | None:
         query = self.images_table.select().where(self.images_table.c.id == image_id)
-        image_from_db = await self.database.fetch_one(query)
+        with track("db_select"):
+            image_from_db = await self.database.fetch_one(query)
         return image_from_db
 
-    async def get_images(self, objects: str | None) -> List[Mapping]:
-        if objects is None:
+    async def get_cached_image(self, image_id: int) -> CachedImage | None:
+        cached_image = await self.image_cache.get(image_id)
+        if cached_image is not None:
+            return cached_image
+
+        image_from_db = await self.get_image(image_id)
+        if image_from_db is None:
+            return None
+        return await self.image_cache.set(row_to_dict(image_from_db))
+
+    async def get_image_by_content_hash(self, content_hash: str) -> Mapping | None:
+        image = self.content_hash_cache.get(content_hash)
+        if image is not None:
+            return image
+
+        query = (
+            self.images_table.select()
+            .where(self.images_table.c.content_hash == content_hash)
+            .order_by(self.images_table.c.analyze_image.desc(), self.images_table.c.id)
+            .limit(1)
+        )
+        with track("db_select"):
+            image_from_db = await self.database.fetch_one(query)
+        if image_from_db is not None:
+            image = row_to_dict(image_from_db)
+            self.content_hash_cache.set(content_hash, image)
+        return image
+
+    async def get_images(
+        self,
+        objects: str | None,
+        limit: int,
+        before_id: int | None = None,
+        fields: List[str] | None = None,
+        match: TagMatch = TagMatch.all,
+        min_confidence: float | None = None,
+    ) -> List[Mapping]:
+        if fields is None:
             query = self.images_table.select()
         else:
-            query = self.images_table.select().where(
-                self.images_table.c.objects.contains(objects.split(","))
+            query = select([self.images_table.c[field] for field in fields])
+
+        if objects is not None:
+            tags = normalize_tags(objects.split(","))
+            if min_confidence is None:
+                image_ids = self.tagged_image_ids(tags, match)
+            else:
+                image_ids = self.labeled_image_ids(tags, match, min_confidence)
+            query = query.where(self.images_table.c.id.in_(image_ids))
+        if before_id is not None:
+            query = query.where(self.images_table.c.id < before_id)
+
+        query = query.order_by(self.images_table.c.id.desc()).limit(limit)
+        with track("db_select"):
+            images_from_db = await self.database.fetch_all(query)
+        return images_from_db
+
+    # Streams every matching image in id order through a server-side cursor,
+    # so only a few rows are held in memory at a time.
+    # updated_at is set to the start of the inserting transaction, and ids are
+    # taken while it runs, so a row can commit after rows with a later id or
+    # updated_at were exported. Rows written in the last settle_seconds are
+    # left out, so a client resuming from the last row it received does not
+    # skip them, as long as no transaction runs for longer than that.
+    async def iterate_images(
+        self,
+        id_after: int | None = None,
+        updated_since: datetime | None = None,
+        settle_seconds: float = 0,
+    ) -> AsyncIterator[Mapping]:
+        query = self.images_table.select()
+        if settle_seconds > 0:
+            query = query.where(
+                self.images_table.c.updated_at
+                < func.now() - cast(timedelta(seconds=settle_seconds), Interval)
             )
-        images_from_db = await self.database.fetch_all(query)
+        if id_after is not None:
+            query = query.where(self.images_table.c.id > id_after)
+        if updated_since is not None:
+            query = query.where(self.images_table.c.updated_at >= updated_since)
+
+        query = query.order_by(self.images_table.c.id)
+        async for image in self.database.iterate(query):
+            yield image
+
+    async def get_images_by_ids(self, image_ids: List[int]) -> List[Mapping]:
+        query = self.images_table.select().where(self.images_table.c.id.in_(image_ids))
+        with track("db_select"):
+            images_from_db = await self.database.fetch_all(query)
         return images_from_db
 
+    # Returns (image, distance) pairs for the images whose perceptual hash is
+    # within max_distance bits of the given image's, closest first.
+    async def get_similar_images(
+        self, image: Mapping, max_distance: int, limit: int
+    ) -> List[Tuple[Mapping, int]]:
+        await self.refresh_similarity_index()
+        with track("similarity_search"):
+            matches = self.similarity_index.search(
+                image["perceptual_hash"], max_distance, limit, exclude_id=image["id"]
+            )
+        if not matches:
+            return []
+
+        images_by_id = {
+            row["id"]: row
+            for row in await self.get_images_by_ids(
+                [image_id for image_id, _ in matches]
+            )
+        }
+        return [
+            (images_by_id[image_id], distance)
+            for image_id, distance in matches
+            if image_id in images_by_id
+        ]
+
+    async def refresh_similarity_index(self, force: bool = False) -> None:
+        await self.similarity_index.refresh(self.iterate_perceptual_hashes, force)
+
+    async def iterate_perceptual_hashes(self, id_after: int) -> AsyncIterator[Mapping]:
+        query = (
+            select(self.images_table.c.id, self.images_table.c.perceptual_hash)
+            .where(self.images_table.c.id > id_after)
+            .where(self.images_table.c.perceptual_hash.isnot(None))
+            .order_by(self.images_table.c.id)
+        )
+        async for row in self.database.iterate(query):
+            yield row
+
+    def tagged_image_ids(self, tags: List[str], match: TagMatch):
+        query = select(self.image_tags_table.c.image_id).where(
+            self.image_tags_table.c.tag.in_(tags)
+        )
+        if match == TagMatch.all:
+            query = query.group_by(self.image_tags_table.c.image_id).having(
+                func.count() == len(tags)
+            )
+        return query
+
+    # Like tagged_image_ids, but from the stored detections, so only images
+    # analyzed since detections were kept are found.
+    def labeled_image_ids(
+        self, labels: List[str], match: TagMatch, min_confidence: float
+    ):
+        query = select(self.image_labels_table.c.image_id).where(
+            self.image_labels_table.c.label.in_(labels),
+            self.image_labels_table.c.confidence > min_confidence,
+        )
+        if match == TagMatch.all:
+            query = query.group_by(self.image_labels_table.c.image_id).having(
+                func.count() == len(labels)
+            )
+        return query
+
+    async def get_tag_counts(self, limit: int) -> List[Mapping]:
+        count = func.count().label("count")
+        query = (
+            select(self.image_tags_table.c.tag.label("object"), count)
+            .group_by(self.image_tags_table.c.tag)
+            .order_by(count.desc(), self.image_tags_table.c.tag)
+            .limit(limit)
+        )
+        with track("db_select"):
+            tag_counts = await self.database.fetch_all(query)
+        return tag_counts
+
     async def create_image(
-        self, label: str, url: str, analyze_image: bool, objects: List[str]
+        self,
+        label: str,
+        url: str,
+        analyze_image: bool,
+        objects: List[str],
+        content_hash: str,
+        derivatives: Dict[str, str] | None,
+        blob_name: str | None = None,
+        perceptual_hash: int | None = None,
+        detections: List[Mapping] | None = None,
     ) -> int:
-        query = self.images_table.insert().values(
-            label=label,
-            url=url,
-            analyze_image=analyze_image,
-            objects=objects,
+        image_ids = await self.create_images(
+            [
+                dict(
+                    label=label,
+                    url=url,
+                    analyze_image=analyze_image,
+                    objects=objects,
+                    content_hash=content_hash,
+                    derivatives=derivatives,
+                    blob_name=blob_name,
+                    perceptual_hash=perceptual_hash,
+                    detections=detections,
+                )
+            ]
         )
+        return image_ids[0]
+
+    async def create_images(self, images: List[Mapping]) -> List[int]:
+        if not images:
+            return []
+
+        with track("db_insert"):
+            async with self.database.transaction():
+                query = (
+                    self.images_table.insert()
+                    .values(list(images))
+                    .returning(self.images_table.c.id)
+                )
+                rows = await self.database.fetch_all(query)
+                image_ids = [row["id"] for row in rows]
+
+                image_tags = [
+                    dict(tag=tag, image_id=image_id)
+                    for values, image_id in zip(images, image_ids)
+                    for tag in normalize_tags(values["objects"])
+                ]
+                if image_tags:
+                    await self.database.execute(
+                        self.image_tags_table.insert().values(image_tags)
+                    )
+
+                image_labels = [
+                    dict(label=label, confidence=confidence, image_id=image_id)
+                    for values, image_id in zip(images, image_ids)
+                    for label, confidence in label_confidences(
+                        values.get("detections") or []
+                    ).items()
+                ]
+                if image_labels:
+                    await self.database.execute(
+                        self.image_labels_table.insert().values(image_labels)
+                    )
+
+        created_images = [
+            dict(values, id=image_id) for values, image_id in zip(images, image_ids)
+        ]
+        for image in created_images:
+            if image.get("perceptual_hash") is not None:
+                self.similarity_index.add(image["id"], image["perceptual_hash"])
+        for image in created_images:
+            self.cache_image(image)
+        await self.image_cache.set_many(created_images)
+        return image_ids
+
+    def cache_image(self, image: Mapping) -> None:
+        cached_image = self.content_hash_cache.get(image["content_hash"])
+        if cached_image is None or (
+            image["analyze_image"] and not cached_image["analyze_image"]
+        ):
+            self.content_hash_cache.set(image["content_hash"], image)
+
+
+def normalize_tags(tags: Iterable[str]) -> List[str]:
+    normalized_tags = (tag.strip().lower() for tag in tags)
+    return list(dict.fromkeys(tag for tag in normalized_tags if tag))
+
+
+def label_confidences(detections: Iterable[Mapping]) -> Dict[str, float]:
+    confidences: Dict[str, float] = {}
+    for detection in detections:
+        for label in normalize_tags([detection["label"]]):
+            confidences[label] = max(
+                confidences.get(label, 0.0), detection["confidence"]
+            )
+    return confidences
+
+
+# Picks objects again from an image's stored detections, for images that have
+# them. Like ingestion and the objects filter, it keeps detections strictly
+# above min_confidence.
+def objects_above(image: Mapping, min_confidence: float) -> List[str]:
+    if image["detections"] is None:
+        return image["objects"]
+    return normalize_tags(
+        detection["label"]
+        for detection in image["detections"]
+        if detection["confidence"] > min_confidence
+    )
+
+
+def row_to_dict(row: Mapping) -> dict:
+    return {key: row[key] for key in row._mapping.keys()}
+
 
-        image_id = await self.database.execute(query)
-        return image_id
+def rows_to_dicts(rows: Iterable[Mapping], fields: List[str]) -> List[dict]:
+    return [{field: row[field] for field in fields} for row in rows]
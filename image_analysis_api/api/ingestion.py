@@ -0,0 +1,260 @@
+import asyncio
+from decimal import Decimal
+import hashlib
+import logging
+from typing import Any, Dict, List, Mapping, Tuple
+
+from fastapi import HTTPException
+from PIL import Image
+from pydantic import ValidationError
+
+from image_analysis_api.api.config import ImageAnalysisConfig
+from image_analysis_api.api.images_repo import ImageRepository
+from image_analysis_api.api.metrics import image_size, track
+from image_analysis_api.api.models import (
+    AnalyzedImage,
+    AnalyzeImageRequest,
+    BatchItemResult,
+)
+from image_analysis_api.api.validators import decode_image_data, validate_image
+from image_analysis_api.services.image_analyzers import Detection, ImageAnalyzer
+from image_analysis_api.services.image_download_service import ImageDownloadService
+from image_analysis_api.services.image_preprocessing_service import (
+    ImagePreprocessingService,
+)
+from image_analysis_api.services.image_storage_service import ImageStorageService
+
+logger = logging.getLogger(__name__)
+
+
+class ImageIngestionPipeline:
+    def __init__(
+        self,
+        config: ImageAnalysisConfig,
+        image_download_service: ImageDownloadService,
+        image_preprocessing_service: ImagePreprocessingService,
+        image_analysis_service: ImageAnalyzer,
+        image_storage_service: ImageStorageService,
+        image_repo: ImageRepository,
+    ) -> None:
+        self.config = config
+        self.image_download_service = image_download_service
+        self.image_preprocessing_service = image_preprocessing_service
+        self.image_analysis_service = image_analysis_service
+        self.image_storage_service = image_storage_service
+        self.image_repo = image_repo
+
+    async def ingest_image(self, request: AnalyzeImageRequest) -> AnalyzedImage:
+        values = await self.prepare_image(request)
+        image_id = await self.image_repo.create_image(**values)
+        return to_analyzed_image(image_id, values)
+
+    async def ingest_image_bytes(
+        self, label: str, analyze_image: bool, image_bytes: bytes, image: Image.Image
+    ) -> AnalyzedImage:
+        values = await self.prepare_image_bytes(
+            label, analyze_image, image_bytes, image
+        )
+        image_id = await self.image_repo.create_image(**values)
+        return to_analyzed_image(image_id, values)
+
+    async def ingest_images(
+        self, items: List[Dict[str, Any]], max_concurrency: int
+    ) -> List[BatchItemResult]:
+        semaphore = asyncio.Semaphore(max_concurrency)
+        prepared: Dict[Tuple[str, bool], "asyncio.Future[Dict[str, Any]]"] = {}
+
+        async def prepare_item(
+            index: int, item: Dict[str, Any]
+        ) -> Dict[str, Any] | BatchItemResult:
+            async with semaphore:
+                try:
+                    request = AnalyzeImageRequest.parse_obj(item)
+                    return await self.prepare_batch_image(request, prepared)
+                except HTTPException as e:
+                    return BatchItemResult(
+                        index=index, status_code=e.status_code, error=e.detail
+                    )
+                except ValidationError as e:
+                    return BatchItemResult(index=index, status_code=422, error=str(e))
+                except Exception:
+                    logger.exception("Failed to process batch item %s", index)
+                    return BatchItemResult(
+                        index=index,
+                        status_code=500,
+                        error="An error occured processing the image",
+                    )
+
+        results = await asyncio.gather(
+            *(prepare_item(index, item) for index, item in enumerate(items))
+        )
+
+        succeeded = [
+            (index, values)
+            for index, values in enumerate(results)
+            if not isinstance(values, BatchItemResult)
+        ]
+        image_ids = await self.image_repo.create_images(
+            [values for _, values in succeeded]
+        )
+        for (index, values), image_id in zip(succeeded, image_ids):
+            results[index] = BatchItemResult(
+                index=index, status_code=200, image=to_analyzed_image(image_id, values)
+            )
+        return results
+
+    # Items of a batch with the same content are prepared once and share the
+    # stored image and detections, so a repeated image is not uploaded and
+    # analyzed again for each copy.
+    async def prepare_batch_image(
+        self,
+        request: AnalyzeImageRequest,
+        prepared: Dict[Tuple[str, bool], "asyncio.Future[Dict[str, Any]]"],
+    ) -> Dict[str, Any]:
+        image_bytes, image = await self.load_image(request)
+        content_hash = hashlib.sha256(image_bytes).hexdigest()
+        key = (content_hash, request.analyze_image)
+        if key not in prepared:
+            prepared[key] = asyncio.ensure_future(
+                self.prepare_image_bytes(
+                    request.label,
+                    request.analyze_image,
+                    image_bytes,
+                    image,
+                    content_hash,
+                )
+            )
+        values = await prepared[key]
+        return dict(values, label=request.label)
+
+    async def prepare_image(self, request: AnalyzeImageRequest) -> Dict[str, Any]:
+        image_bytes, image = await self.load_image(request)
+        return await self.prepare_image_bytes(
+            request.label, request.analyze_image, image_bytes, image
+        )
+
+    async def prepare_image_bytes(
+        self,
+        label: str,
+        analyze_image: bool,
+        image_bytes: bytes,
+        image: Image.Image,
+        content_hash: str | None = None,
+    ) -> Dict[str, Any]:
+        if content_hash is None:
+            content_hash = hashlib.sha256(image_bytes).hexdigest()
+        existing_image = await self.image_repo.get_image_by_content_hash(content_hash)
+        reuse_objects = existing_image is not None and existing_image["analyze_image"]
+
+        pending = {}
+        if existing_image is None:
+            blob_name = get_image_name(image, content_hash)
+            pending["stored_image"] = self.image_storage_service.store_image(
+                blob_name, image_bytes
+            )
+        else:
+            blob_name = existing_image["blob_name"]
+        if existing_image is None or existing_image["perceptual_hash"] is None:
+            pending["perceptual_hash"] = self.compute_perceptual_hash(image_bytes)
+        if analyze_image and not reuse_objects:
+            pending["detections"] = self.detect_objects(image_bytes, image)
+        results = dict(zip(pending, await asyncio.gather(*pending.values())))
+
+        if existing_image is None:
+            url, derivatives = results["stored_image"]
+        else:
+            url, derivatives = existing_image["url"], existing_image["derivatives"]
+        if "perceptual_hash" in results:
+            perceptual_hash = results["perceptual_hash"]
+        else:
+            perceptual_hash = existing_image["perceptual_hash"]
+
+        if not analyze_image:
+            objects, detections = [], None
+        elif reuse_objects:
+            objects, detections = (
+                existing_image["objects"],
+                existing_image["detections"],
+            )
+        else:
+            acceptable_confidence_score = Decimal(
+                self.config.acceptable_confidence_score
+            )
+            objects = [
+                detection.label
+                for detection in results["detections"]
+                if Decimal(detection.confidence) > acceptable_confidence_score
+            ]
+            detections = [detection.to_dict() for detection in results["detections"]]
+
+        return dict(
+            label=label,
+            url=url,
+            analyze_image=analyze_image,
+            objects=objects,
+            content_hash=content_hash,
+            derivatives=derivatives,
+            blob_name=blob_name,
+            perceptual_hash=perceptual_hash,
+            detections=detections,
+        )
+
+    async def compute_perceptual_hash(self, image_bytes: bytes) -> int:
+        with track("perceptual_hash"):
+            return await self.image_preprocessing_service.compute_perceptual_hash(
+                image_bytes
+            )
+
+    async def detect_objects(
+        self, image_bytes: bytes, image: Image.Image
+    ) -> List[Detection]:
+        with track("preprocess"):
+            analysis_bytes = (
+                await self.image_preprocessing_service.prepare_for_analysis(
+                    image_bytes, image
+                )
+            )
+        # Detections below the acceptable score are kept too, so objects can
+        # be picked with a different score later without analyzing again.
+        min_confidence = min(
+            Decimal(self.config.detection_min_confidence),
+            Decimal(self.config.acceptable_confidence_score),
+        )
+        with track("detect_objects"):
+            return await self.image_analysis_service.detect_objects(
+                analysis_bytes, min_confidence
+            )
+
+    async def load_image(
+        self, request: AnalyzeImageRequest
+    ) -> Tuple[bytes, Image.Image]:
+        if request.image_data is not None:
+            with track("decode"):
+                image_bytes = decode_image_data(request.image_data)
+            image_size.observe(len(image_bytes), "image_data")
+            with track("validate"):
+                image = validate_image(image_bytes, None, "image_data")
+        else:
+            with track("download"):
+                (
+                    image_bytes,
+                    content_type,
+                ) = await self.image_download_service.download_image(request.image_url)
+            image_size.observe(len(image_bytes), "image_url")
+            with track("validate"):
+                image = validate_image(image_bytes, content_type, request.image_url)
+        return image_bytes, image
+
+
+def get_image_name(image: Image.Image, content_hash: str) -> str:
+    return f"image-{content_hash}.{image.format.lower()}"
+
+
+def to_analyzed_image(image_id: int, values: Mapping) -> AnalyzedImage:
+    return AnalyzedImage(
+        id=image_id,
+        label=values["label"],
+        objects=values["objects"],
+        url=values["url"],
+        derivatives=values["derivatives"],
+    )
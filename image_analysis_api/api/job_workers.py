@@ -0,0 +1,146 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Mapping, TypeVar
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+from image_analysis_api.api.ingestion import ImageIngestionPipeline
+from image_analysis_api.api.jobs_repo import JobRepository
+from image_analysis_api.api.models import AnalyzeImageRequest
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class JobWorkerPool:
+    def __init__(
+        self,
+        job_repo: JobRepository,
+        pipeline_factory: Callable[[], ImageIngestionPipeline],
+        workers: int,
+        poll_interval: float,
+        lease_seconds: int,
+        max_attempts: int,
+    ) -> None:
+        self.job_repo = job_repo
+        self.pipeline_factory = pipeline_factory
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.wakeup = asyncio.Event()
+        self.tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        self.tasks = [
+            asyncio.create_task(self.run_worker(), name=f"job-worker-{number}")
+            for number in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        # Jobs that are still running keep their lease and are re-claimed once
+        # it expires, the same way jobs from a crashed process are.
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def notify(self) -> None:
+        self.wakeup.set()
+
+    async def run_worker(self) -> None:
+        while True:
+            try:
+                job = await self.job_repo.claim_job(self.lease_seconds)
+            except Exception:
+                logger.exception("Failed to claim a job")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+
+            try:
+                await self.process_job(job)
+            except Exception:
+                logger.exception("Failed to process job %s", job["id"])
+
+    async def process_job(self, job: Mapping) -> None:
+        job_id, lease_token = job["id"], job["lease_token"]
+        if job["attempts"] > self.max_attempts:
+            await self.job_repo.fail_job(
+                job_id, lease_token, "Job exceeded the maximum number of attempts"
+            )
+            return
+
+        try:
+            request = AnalyzeImageRequest.parse_obj(job["request"])
+            image = await self.run_with_lease(
+                job_id, lease_token, self.pipeline_factory().ingest_image(request)
+            )
+        except LeaseLost:
+            # Another worker has claimed the job, so it owns the outcome.
+            logger.warning("Job %s lost its lease and was stopped", job_id)
+            return
+        except HTTPException as e:
+            # 5xx errors come from Azure being slow or unavailable, so the job
+            # is worth another attempt.
+            if e.status_code >= 500 and job["attempts"] < self.max_attempts:
+                await self.job_repo.requeue_job(job_id, lease_token)
+            else:
+                await self.job_repo.fail_job(job_id, lease_token, e.detail)
+        except ValidationError as e:
+            await self.job_repo.fail_job(job_id, lease_token, str(e))
+        except Exception:
+            logger.exception("Job %s failed", job_id)
+            if job["attempts"] < self.max_attempts:
+                await self.job_repo.requeue_job(job_id, lease_token)
+            else:
+                await self.job_repo.fail_job(
+                    job_id, lease_token, "An error occured processing the image"
+                )
+        else:
+            if not await self.job_repo.complete_job(job_id, lease_token, image.id):
+                logger.warning("Job %s finished after losing its lease", job_id)
+
+    # Renews the job's lease while the work runs, and stops the work if the
+    # lease is lost, so a slow job is never ingested twice.
+    async def run_with_lease(
+        self, job_id: int, lease_token: str, work: Awaitable[T]
+    ) -> T:
+        work_task = asyncio.ensure_future(work)
+        lease_task = asyncio.create_task(self.keep_lease(job_id, lease_token))
+        try:
+            await asyncio.wait(
+                {work_task, lease_task}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not work_task.done():
+                work_task.cancel()
+                await asyncio.gather(work_task, return_exceptions=True)
+                lease_task.result()
+            return work_task.result()
+        finally:
+            work_task.cancel()
+            lease_task.cancel()
+            await asyncio.gather(lease_task, return_exceptions=True)
+
+    async def keep_lease(self, job_id: int, lease_token: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await self.job_repo.renew_lease(job_id, lease_token)
+            except Exception:
+                logger.exception("Failed to renew the lease of job %s", job_id)
+                continue
+            if not renewed:
+                raise LeaseLost()
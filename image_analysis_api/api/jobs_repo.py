@@ -0,0 +1,120 @@
+from datetime import timedelta
+from typing import Any, Dict, Mapping
+import uuid
+
+from databases import Database
+from sqlalchemy import Interval, Table, and_, cast, func, or_, select
+
+from image_analysis_api.api.models import JobStatus
+
+
+class JobRepository:
+    def __init__(
+        self, jobs_table: Table, images_table: Table, database: Database
+    ) -> None:
+        self.jobs_table = jobs_table
+        self.images_table = images_table
+        self.database = database
+
+    async def create_job(self, request: Dict[str, Any]) -> int:
+        query = self.jobs_table.insert().values(
+            status=JobStatus.queued.value, request=request
+        )
+        job_id = await self.database.execute(query)
+        return job_id
+
+    async def get_job(self, job_id: int) -> Mapping | None:
+        query = (
+            select(
+                self.jobs_table.c.id,
+                self.jobs_table.c.status,
+                self.jobs_table.c.error,
+                self.jobs_table.c.image_id,
+                self.images_table.c.label,
+                self.images_table.c.url,
+                self.images_table.c.objects,
+                self.images_table.c.derivatives,
+            )
+            .select_from(
+                self.jobs_table.outerjoin(
+                    self.images_table,
+                    self.jobs_table.c.image_id == self.images_table.c.id,
+                )
+            )
+            .where(self.jobs_table.c.id == job_id)
+        )
+        job_from_db = await self.database.fetch_one(query)
+        return job_from_db
+
+    async def claim_job(self, lease_seconds: int) -> Mapping | None:
+        lease_expired = and_(
+            self.jobs_table.c.status == JobStatus.running.value,
+            self.jobs_table.c.claimed_at
+            < func.now() - cast(timedelta(seconds=lease_seconds), Interval),
+        )
+        next_job_id = (
+            select(self.jobs_table.c.id)
+            .where(
+                or_(self.jobs_table.c.status == JobStatus.queued.value, lease_expired)
+            )
+            .order_by(self.jobs_table.c.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        query = (
+            self.jobs_table.update()
+            .where(self.jobs_table.c.id == next_job_id)
+            .values(
+                status=JobStatus.running.value,
+                claimed_at=func.now(),
+                lease_token=uuid.uuid4().hex,
+                attempts=self.jobs_table.c.attempts + 1,
+            )
+            .returning(
+                self.jobs_table.c.id,
+                self.jobs_table.c.request,
+                self.jobs_table.c.attempts,
+                self.jobs_table.c.lease_token,
+            )
+        )
+        job_from_db = await self.database.fetch_one(query)
+        return job_from_db
+
+    async def renew_lease(self, job_id: int, lease_token: str) -> bool:
+        return await self.update_leased_job(job_id, lease_token, claimed_at=func.now())
+
+    async def complete_job(self, job_id: int, lease_token: str, image_id: int) -> bool:
+        return await self.update_leased_job(
+            job_id,
+            lease_token,
+            status=JobStatus.succeeded.value,
+            image_id=image_id,
+            error=None,
+        )
+
+    async def requeue_job(self, job_id: int, lease_token: str) -> bool:
+        return await self.update_leased_job(
+            job_id, lease_token, status=JobStatus.queued.value, claimed_at=None
+        )
+
+    async def fail_job(self, job_id: int, lease_token: str, error: str) -> bool:
+        return await self.update_leased_job(
+            job_id, lease_token, status=JobStatus.failed.value, error=error
+        )
+
+    # Returns False when the lease expired and the job was claimed again.
+    async def update_leased_job(
+        self, job_id: int, lease_token: str, **values: Any
+    ) -> bool:
+        query = (
+            self.jobs_table.update()
+            .where(
+                self.jobs_table.c.id == job_id,
+                self.jobs_table.c.status == JobStatus.running.value,
+                self.jobs_table.c.lease_token == lease_token,
+            )
+            .values(**values)
+            .returning(self.jobs_table.c.id)
+        )
+        return await self.database.fetch_one(query) is not None
@@ -1,85 +1,409 @@
-import base64
-from decimal import Decimal
-from io import BytesIO
+from datetime import datetime
+import mimetypes
+import os
 from typing import List
-import uuid
-from PIL import Image
 
-import requests
-
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import (
+    JSONResponse,
+    ORJSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
+from pydantic import ValidationError
 
 
+from image_analysis_api.api.cache import etag_matches
 from image_analysis_api.api.config import ImageAnalysisConfig, get_config
-from image_analysis_api.api.images_repo import ImageRepository
-from image_analysis_api.services.image_analysis_service import ImageAnalysisService
-from image_analysis_api.services.image_storage_service import ImageStorageService
-from image_analysis_api.api.models import AnalyzeImageRequest, AnalyzedImage
-from image_analysis_api.api.db import database, images
+from image_analysis_api.api.dependencies import (
+    close_clients,
+    get_image_repository,
+    get_analysis_admission,
+    get_ingestion_pipeline,
+    get_job_repository,
+    get_job_worker_pool,
+    get_storage_backend,
+    open_clients,
+    start_job_workers,
+    stop_job_workers,
+)
+from image_analysis_api.api.images_repo import (
+    ImageRepository,
+    objects_above,
+    row_to_dict,
+    rows_to_dicts,
+)
+from image_analysis_api.api.ingestion import ImageIngestionPipeline
+from image_analysis_api.api.job_workers import JobWorkerPool
+from image_analysis_api.api.jobs_repo import JobRepository
+from image_analysis_api.api.models import (
+    AnalyzeImageRequest,
+    AnalyzeImagesBatchRequest,
+    AnalyzeImagesBatchResponse,
+    AnalyzedImage,
+    ImageUploadForm,
+    Job,
+    JobStatus,
+    ObjectCount,
+    SimilarImage,
+    TagMatch,
+)
+from image_analysis_api.api.db import get_database
+from image_analysis_api.api.exports import ndjson_chunks
+from image_analysis_api.api.file_responses import RangeFileResponse
+from image_analysis_api.api.metrics import (
+    MetricsMiddleware,
+    image_size,
+    render_metrics,
+    track,
+)
+from image_analysis_api.api.migrate import create_schema
+from image_analysis_api.api.uploads import ImageUploadParser, upload_is_allowable_size
+from image_analysis_api.api.validators import validate_image
+from image_analysis_api.services.admission import AdmissionController
+from image_analysis_api.services.storage_backends import StorageBackend
 
 app = FastAPI(
     title="Image Analysis API", description="Image Analysis API", version="1.0.0"
 )
+app.add_middleware(MetricsMiddleware)
 
 
 @app.on_event("startup")
 async def startup():
-    await database.connect()
+    config = get_config()
+    if config.create_schema_on_startup:
+        await run_in_threadpool(create_schema, config.postgres_connection_string)
+    await get_database().connect()
+    await open_clients()
+    await start_job_workers()
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    await database.disconnect()
+    await stop_job_workers()
+    await get_database().disconnect()
+    await close_clients()
+
+
+# Declared before /images/{image_id} so "export" is not taken for an image id.
+@app.get(
+    "/images/export",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {"application/x-ndjson": {}},
+            "description": "Every matching image, one JSON object per line",
+        }
+    },
+)
+async def export_images(
+    id_after: int
+    | None = Query(default=None, title="Only export images with a higher id"),
+    updated_since: datetime
+    | None = Query(
+        default=None, title="Only export images updated at or after this time"
+    ),
+    config: ImageAnalysisConfig = Depends(get_config),
+    image_repo: ImageRepository = Depends(get_image_repository),
+):
+    images = image_repo.iterate_images(
+        id_after=id_after,
+        updated_since=updated_since,
+        settle_seconds=config.export_settle_seconds,
+    )
+    return StreamingResponse(
+        ndjson_chunks(images, config.export_chunk_size),
+        media_type="application/x-ndjson",
+    )
 
 
 @app.get("/images/{image_id}", response_model=AnalyzedImage)
-async def get_image_by_id(image_id: int):
-    image_repo = ImageRepository(images, database)
+async def get_image_by_id(
+    image_id: int,
+    request: Request,
+    config: ImageAnalysisConfig = Depends(get_config),
+    image_repo: ImageRepository = Depends(get_image_repository),
+):
+    img = await image_repo.get_cached_image(image_id)
+    if img is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    headers = {
+        "ETag": img.etag,
+        "Cache-Control": f"public, max-age={config.image_cache_max_age}",
+    }
+    if etag_matches(request.headers.get("If-None-Match"), img.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=img.body, media_type="application/json", headers=headers)
+
+
+@app.get(
+    "/images/{image_id}/content",
+    response_class=Response,
+    responses={
+        200: {"content": {"image/*": {}}, "description": "The original image"},
+        206: {"description": "Part of the original image"},
+        307: {"description": "The image is served by the storage backend"},
+    },
+)
+async def get_image_content(
+    image_id: int,
+    request: Request,
+    config: ImageAnalysisConfig = Depends(get_config),
+    image_repo: ImageRepository = Depends(get_image_repository),
+    storage_backend: StorageBackend = Depends(get_storage_backend),
+):
+    img = await image_repo.get_image(image_id)
+    if img is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    path = storage_backend.local_path(img["blob_name"]) if img["blob_name"] else None
+    if path is None:
+        return RedirectResponse(img["url"], status_code=307)
+
+    try:
+        file_size = (await run_in_threadpool(os.stat, path)).st_size
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image content not found")
+
+    # Blob names include the content hash, so the content never changes.
+    headers = {
+        "ETag": f'"{img["content_hash"]}"',
+        "Cache-Control": f"public, max-age={config.image_content_max_age}, immutable",
+    }
+    if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    media_type = mimetypes.guess_type(img["blob_name"])[0] or "application/octet-stream"
+    return RangeFileResponse(
+        path, file_size, request.headers.get("Range"), media_type, headers
+    )
+
+
+@app.get("/images/{image_id}/similar", response_model=List[SimilarImage])
+async def get_similar_images(
+    image_id: int,
+    max_distance: int = Query(
+        default=10,
+        ge=0,
+        le=64,
+        title="Most bits that can differ between the images' perceptual hashes",
+    ),
+    limit: int = Query(default=20, ge=1, le=100),
+    image_repo: ImageRepository = Depends(get_image_repository),
+):
     img = await image_repo.get_image(image_id)
     if img is None:
         raise HTTPException(status_code=404, detail="Image not found")
-    return img
+    if img["perceptual_hash"] is None:
+        raise HTTPException(
+            status_code=404, detail="Image has no perceptual hash to compare"
+        )
+
+    similar_images = await image_repo.get_similar_images(img, max_distance, limit)
+    return [
+        dict(row_to_dict(image), distance=distance)
+        for image, distance in similar_images
+    ]
 
 
 @app.get("/images", response_model=List[AnalyzedImage] | List)
-async def get_images(objects: str | None = None):
-    image_repo = ImageRepository(images, database)
-    images_from_db = await image_repo.get_images(objects)
-    return images_from_db
+async def get_images(
+    request: Request,
+    objects: str | None = None,
+    match: TagMatch = Query(
+        default=TagMatch.all, title="Whether images need all or any of the objects"
+    ),
+    limit: int | None = Query(default=None, ge=1),
+    cursor: int
+    | None = Query(
+        default=None, title="Return images with an id lower than this cursor"
+    ),
+    fields: str
+    | None = Query(default=None, title="Comma separated list of fields to return"),
+    min_confidence: float
+    | None = Query(
+        default=None,
+        ge=0,
+        le=1,
+        title="Return objects, and match the objects filter, above this confidence",
+    ),
+    config: ImageAnalysisConfig = Depends(get_config),
+    image_repo: ImageRepository = Depends(get_image_repository),
+):
+    if limit is None:
+        limit = config.images_page_default_limit
+    limit = min(limit, config.images_page_max_limit)
+
+    selected_fields = list(AnalyzedImage.__fields__)
+    if fields is not None:
+        selected_fields = fields.split(",")
+        invalid_fields = set(selected_fields) - set(AnalyzedImage.__fields__)
+        if invalid_fields:
+            raise HTTPException(
+                status_code=400,
+                detail=f"{','.join(sorted(invalid_fields))} are invalid fields. Must be any of {list(AnalyzedImage.__fields__)}",
+            )
+        if "id" not in selected_fields:
+            selected_fields.insert(0, "id")
+
+    rethreshold = min_confidence is not None and "objects" in selected_fields
+    images_from_db = await image_repo.get_images(
+        objects,
+        limit,
+        before_id=cursor,
+        fields=selected_fields + ["detections"] if rethreshold else selected_fields,
+        match=match,
+        min_confidence=min_confidence,
+    )
+
+    headers = {}
+    if len(images_from_db) == limit:
+        next_cursor = images_from_db[-1]["id"]
+        next_url = request.url.include_query_params(cursor=next_cursor)
+        headers["X-Next-Cursor"] = str(next_cursor)
+        headers["Link"] = f'<{next_url}>; rel="next"'
 
+    # Rows come straight from the database, so they are returned as they are
+    # instead of being validated against response_model, which is kept for the
+    # OpenAPI schema.
+    images = rows_to_dicts(images_from_db, selected_fields)
+    if rethreshold:
+        for image, image_from_db in zip(images, images_from_db):
+            image["objects"] = objects_above(image_from_db, min_confidence)
+    return ORJSONResponse(images, headers=headers)
 
-@app.post("/images", response_model=AnalyzedImage)
+
+@app.get("/objects", response_model=List[ObjectCount])
+async def get_objects(
+    limit: int = Query(default=100, ge=1, le=1000),
+    image_repo: ImageRepository = Depends(get_image_repository),
+):
+    return await image_repo.get_tag_counts(limit)
+
+
+@app.post(
+    "/images",
+    response_model=AnalyzedImage,
+    responses={202: {"model": Job, "description": "Image queued for analysis"}},
+)
 async def analyze_image(
-    request: AnalyzeImageRequest, config: ImageAnalysisConfig = Depends(get_config)
+    request: AnalyzeImageRequest,
+    run_async: bool = Query(
+        default=False,
+        alias="async",
+        title="Queue the image and return a job instead of waiting for the result",
+    ),
+    pipeline: ImageIngestionPipeline = Depends(get_ingestion_pipeline),
+    job_repo: JobRepository = Depends(get_job_repository),
+    job_worker_pool: JobWorkerPool = Depends(get_job_worker_pool),
 ):
-    if request.image_data is not None:
-        image_bytes = base64.b64decode(request.image_data)
-    else:
-        image_bytes = requests.get(request.image_url).content
-
-    if request.analyze_image:
-        image_analysis_service = ImageAnalysisService(
-            config.azure_cs_endpoint, config.azure_cs_api_key
+    if run_async:
+        job_id = await job_repo.create_job(request.dict())
+        job_worker_pool.notify()
+        job = Job(id=job_id, status=JobStatus.queued)
+        return JSONResponse(
+            status_code=202,
+            content=job.dict(),
+            headers={"Location": f"/jobs/{job_id}"},
         )
 
-        objects = image_analysis_service.detect_objects(
-            image_bytes, Decimal(config.acceptable_confidence_score)
-        )
-    else:
-        objects = []
+    return await pipeline.ingest_image(request)
+
 
-    image_blob_name = get_image_name(BytesIO(image_bytes))
-    image_service = ImageStorageService(config.azure_storage_connection_string)
-    url = image_service.upload_image(image_blob_name, image_bytes)
+@app.post(
+    "/images/upload",
+    response_model=AnalyzedImage,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "required": ["file"],
+                        "properties": {
+                            "label": {"type": "string", "maxLength": 50},
+                            "analyze_image": {"type": "boolean"},
+                            "file": {"type": "string", "format": "binary"},
+                        },
+                    }
+                }
+            },
+        }
+    },
+)
+async def upload_image(
+    request: Request,
+    pipeline: ImageIngestionPipeline = Depends(get_ingestion_pipeline),
+):
+    if not upload_is_allowable_size(request.headers.get("Content-Length")):
+        raise HTTPException(status_code=400, detail="Image must be smaller than 4 MB")
 
-    image_repo = ImageRepository(images, database)
-    image_id = await image_repo.create_image(
-        request.label, url, request.analyze_image, objects
+    parser = ImageUploadParser(request.headers.get("Content-Type", ""))
+    upload = await parser.parse(request.stream())
+    try:
+        form = ImageUploadForm.parse_obj(upload.fields)
+    except ValidationError as e:
+        raise RequestValidationError(e.raw_errors)
+
+    image_size.observe(len(upload.image_bytes), "upload")
+    with track("validate"):
+        image = validate_image(upload.image_bytes, upload.content_type, upload.filename)
+    return await pipeline.ingest_image_bytes(
+        form.label, form.analyze_image, upload.image_bytes, image
     )
 
-    return AnalyzedImage(id=image_id, label=request.label, objects=objects, url=url)
 
+@app.post("/images/batch", response_model=AnalyzeImagesBatchResponse)
+async def analyze_images_batch(
+    request: AnalyzeImagesBatchRequest,
+    config: ImageAnalysisConfig = Depends(get_config),
+    pipeline: ImageIngestionPipeline = Depends(get_ingestion_pipeline),
+):
+    if len(request.items) > config.batch_max_items:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch cannot contain more than {config.batch_max_items} images",
+        )
+
+    results = await pipeline.ingest_images(request.items, config.batch_max_concurrency)
+    return AnalyzeImagesBatchResponse(results=results)
 
-def get_image_name(image_data: BytesIO) -> str:
-    image = Image.open(image_data)
-    return f"image-{uuid.uuid4()}.{image.format.lower()}"
+
+@app.get("/jobs/{job_id}", response_model=Job)
+async def get_job_by_id(
+    job_id: int, job_repo: JobRepository = Depends(get_job_repository)
+):
+    job = await job_repo.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    image = None
+    if job["image_id"] is not None:
+        image = AnalyzedImage(
+            id=job["image_id"],
+            label=job["label"],
+            url=job["url"],
+            objects=job["objects"],
+            derivatives=job["derivatives"],
+        )
+    return Job(id=job["id"], status=job["status"], image=image, error=job["error"])
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/admission", include_in_schema=False)
+async def get_admission_state(
+    admission: AdmissionController | None = Depends(get_analysis_admission),
+):
+    if admission is None:
+        return {"enabled": False}
+    return {"enabled": True, **admission.state()}
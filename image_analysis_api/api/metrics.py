@@ -0,0 +1,228 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextvars import ContextVar
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from image_analysis_api.api.config import get_config
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = tuple(16 * 1024 * 2**power for power in range(9))
+
+LabelValues = Tuple[str, ...]
+
+registry: List["Metric"] = []
+
+
+# Metrics are only updated from the event loop thread, so they need no locks
+# and an update is a dict lookup and a couple of additions.
+class Metric(ABC):
+    type_name = ""
+
+    def __init__(self, name: str, description: str, labels: Sequence[str]) -> None:
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        registry.append(self)
+
+    def format_labels(self, values: LabelValues, **extra: str) -> str:
+        pairs = list(zip(self.labels, values)) + list(extra.items())
+        if not pairs:
+            return ""
+        return (
+            "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+        )
+
+    @abstractmethod
+    def render_samples(self) -> List[str]:
+        ...
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type_name}",
+            *self.render_samples(),
+        ]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, description, labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render_samples(self) -> List[str]:
+        return [
+            f"{self.name}{self.format_labels(labels)} {value}"
+            for labels, value in sorted(self.values.items())
+        ]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, *label_values: str, amount: float = 1) -> None:
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value: float, *label_values: str) -> None:
+        self.values[label_values] = value
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DURATION_BUCKETS,
+    ) -> None:
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+        # Per label values: a count for each bucket plus +Inf, and the sum.
+        self.values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        entry = self.values.get(label_values)
+        if entry is None:
+            entry = self.values[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = entry
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render_samples(self) -> List[str]:
+        lines = []
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f"{self.name}_bucket{self.format_labels(labels, le=le)} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{self.format_labels(labels)} {total[0]}")
+            lines.append(f"{self.name}_count{self.format_labels(labels)} {cumulative}")
+        return lines
+
+
+request_duration = Histogram(
+    "image_analysis_request_duration_seconds",
+    "Time taken to handle HTTP requests",
+    ["method", "route", "status"],
+)
+requests_in_flight = Gauge(
+    "image_analysis_requests_in_flight", "HTTP requests currently being handled"
+)
+stage_duration = Histogram(
+    "image_analysis_stage_duration_seconds",
+    "Time taken by each stage of processing an image",
+    ["stage"],
+)
+stages_in_flight = Gauge(
+    "image_analysis_stages_in_flight", "Stages currently running", ["stage"]
+)
+stage_errors = Counter(
+    "image_analysis_stage_errors_total", "Stages that raised an error", ["stage"]
+)
+image_size = Histogram(
+    "image_analysis_image_size_bytes",
+    "Size of images received for analysis",
+    ["source"],
+    buckets=SIZE_BUCKETS,
+)
+
+# Stage durations for the current request, when Server-Timing is enabled.
+server_timings: ContextVar[Dict[str, float] | None] = ContextVar(
+    "server_timings", default=None
+)
+
+
+class StageTimer:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage: str) -> None:
+        self.stage = stage
+
+    def __enter__(self) -> None:
+        stages_in_flight.inc(self.stage)
+        self.started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        elapsed = time.perf_counter() - self.started
+        stages_in_flight.dec(self.stage)
+        stage_duration.observe(elapsed, self.stage)
+        if exc_type is not None:
+            stage_errors.inc(self.stage)
+
+        timings = server_timings.get()
+        if timings is not None:
+            timings[self.stage] = timings.get(self.stage, 0.0) + elapsed
+
+
+def track(stage: str) -> StageTimer:
+    return StageTimer(stage)
+
+
+def escape(label_value: str) -> str:
+    return label_value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics() -> str:
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+def format_server_timing(timings: Dict[str, float], total: float) -> str:
+    entries = [
+        f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in timings.items()
+    ]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = "500"
+        timings = None
+        if get_config().server_timing:
+            timings = {}
+            server_timings.set(timings)
+
+        async def send_with_metrics(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                if timings is not None:
+                    header = format_server_timing(
+                        timings, time.perf_counter() - started
+                    )
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", header.encode("latin-1"))
+                    ]
+            await send(message)
+
+        requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            requests_in_flight.dec()
+            endpoint = scope.get("endpoint")
+            route = endpoint.__name__ if endpoint is not None else "unmatched"
+            request_duration.observe(
+                time.perf_counter() - started, scope["method"], route, status
+            )
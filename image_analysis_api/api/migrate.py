@@ -0,0 +1,76 @@
+import sys
+
+from sqlalchemy import create_engine, text
+
+from image_analysis_api.api.config import get_config
+from image_analysis_api.api.db import metadata
+
+# Brings tables created by earlier versions up to date. Every statement must be
+# safe to run again, since this runs on each migration.
+UPGRADE_STATEMENTS = [
+    "ALTER TABLE images ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "CREATE INDEX IF NOT EXISTS ix_images_content_hash ON images (content_hash)",
+    "ALTER TABLE images ADD COLUMN IF NOT EXISTS derivatives JSONB",
+    "ALTER TABLE images ADD COLUMN IF NOT EXISTS blob_name VARCHAR",
+    """
+    ALTER TABLE images
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_images_updated_at ON images (updated_at)",
+    "ALTER TABLE images ADD COLUMN IF NOT EXISTS perceptual_hash BIGINT",
+    "ALTER TABLE images ADD COLUMN IF NOT EXISTS detections JSONB",
+    "ALTER TABLE jobs ADD COLUMN IF NOT EXISTS lease_token VARCHAR(32)",
+    """
+    CREATE TABLE IF NOT EXISTS data_migrations (
+        name VARCHAR PRIMARY KEY,
+        applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+    )
+    """,
+]
+
+# Rewrites existing rows. Each one runs once, the first time the migration
+# runs after it is added, and is recorded by name in data_migrations.
+DATA_MIGRATIONS = [
+    (
+        "backfill_image_tags",
+        """
+        INSERT INTO image_tags (tag, image_id)
+        SELECT DISTINCT lower(trim(object)), images.id
+        FROM images, unnest(images.objects) AS object
+        WHERE trim(object) <> ''
+        ON CONFLICT DO NOTHING
+        """,
+    ),
+]
+
+
+def create_schema(connection_string: str) -> None:
+    engine = create_engine(connection_string)
+    try:
+        with engine.begin() as connection:
+            metadata.create_all(connection)
+            for statement in UPGRADE_STATEMENTS:
+                connection.execute(text(statement))
+            for name, statement in DATA_MIGRATIONS:
+                # Another process migrating at the same time waits here until
+                # this transaction commits, and then skips the migration.
+                recorded = connection.execute(
+                    text(
+                        "INSERT INTO data_migrations (name) VALUES (:name)"
+                        " ON CONFLICT DO NOTHING RETURNING name"
+                    ),
+                    {"name": name},
+                ).first()
+                if recorded is not None:
+                    connection.execute(text(statement))
+    finally:
+        engine.dispose()
+
+
+def main() -> None:
+    create_schema(get_config().postgres_connection_string)
+    print("Database schema is up to date", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,15 @@
-import uuid
+from enum import Enum
+
 from fastapi import HTTPException
 from pydantic import BaseModel, Field, root_validator, validator
 
-import io
-from typing import List
-from urllib.parse import urlparse
+from typing import Any, Dict, List
 import namesgenerator
 
-
-import requests
-from fastapi import HTTPException
-from PIL import Image
-
 from image_analysis_api.api.validators import (
-    image_has_allowed_content_type,
-    image_is_allowable_dimensions,
+    base64_decoded_size,
     image_is_allowable_size,
     is_url_valid,
-    allowed_image_types,
 )
 
 
@@ -26,6 +18,25 @@ class AnalyzedImage(BaseModel):
     label: str
     url: str
     objects: List[str]
+    derivatives: Dict[str, str] | None = Field(
+        default=None, title="URLs of resized copies of the image, keyed by name"
+    )
+
+
+class SimilarImage(AnalyzedImage):
+    distance: int = Field(
+        title="Number of bits that differ between the images' perceptual hashes"
+    )
+
+
+class TagMatch(str, Enum):
+    any = "any"
+    all = "all"
+
+
+class ObjectCount(BaseModel):
+    object: str
+    count: int
 
 
 class AnalyzeImageRequest(BaseModel):
@@ -63,38 +74,57 @@ class AnalyzeImageRequest(BaseModel):
             raise HTTPException(
                 status_code=400, detail=f"{image_url} is an invalid URL"
             )
-        try:
-            response = requests.head(image_url)
-            if not response.ok:
-                raise HTTPException(
-                    status_code=400, detail=f"{image_url} does not exist"
-                )
-        except requests.exceptions.RequestException:
-            raise HTTPException(
-                status_code=400,
-                detail=f"An error occured accessing the image at {image_url}",
-            )
 
-        img_response = requests.get(image_url)
-        image_bytes = img_response.content
-        image_data = io.BytesIO(image_bytes)
-        image = Image.open(image_data)
-        if not image_is_allowable_dimensions(image):
-            raise HTTPException(
-                status_code=400,
-                detail=f"{image_url} does not meet the minimum dimensions of 50 x 50",
-            )
+        return v
 
-        content_type: str = response.headers["Content-Type"]
-        if not image_has_allowed_content_type(content_type):
-            raise HTTPException(
-                status_code=400,
-                detail=f"{content_type} is an invalid content type. Must be one of {allowed_image_types}",
-            )
+    @validator("image_data")
+    def validate_image_data(cls, v):
+        if v is None:
+            return v
 
-        if not image_is_allowable_size(len(image_bytes)):
+        # Reject oversized payloads from the string length alone, before
+        # anything is decoded.
+        if not image_is_allowable_size(base64_decoded_size(v)):
             raise HTTPException(
                 status_code=400, detail="Image must be smaller than 4 MB"
             )
 
         return v
+
+
+class ImageUploadForm(BaseModel):
+    label: str = Field(
+        default_factory=namesgenerator.get_random_name, min_length=1, max_length=50
+    )
+    analyze_image: bool = Field(default=False, title="If image analysis should be run")
+
+
+class AnalyzeImagesBatchRequest(BaseModel):
+    items: List[Dict[str, Any]] = Field(
+        ..., min_items=1, title="AnalyzeImageRequest bodies to ingest"
+    )
+
+
+class BatchItemResult(BaseModel):
+    index: int
+    status_code: int
+    image: AnalyzedImage | None = None
+    error: str | None = None
+
+
+class AnalyzeImagesBatchResponse(BaseModel):
+    results: List[BatchItemResult]
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+
+
+class Job(BaseModel):
+    id: int
+    status: JobStatus
+    image: AnalyzedImage | None = None
+    error: str | None = None
@@ -0,0 +1,131 @@
+import asyncio
+import time
+from typing import AsyncIterator, Callable, List, Mapping, Set, Tuple
+
+UINT64_MASK = (1 << 64) - 1
+
+
+# Keeps the perceptual hash of every image in memory, so similar images are
+# found with one vectorized Hamming distance scan. Images inserted by this
+# process are added as they are created, and images inserted by other
+# processes are loaded when the index is refreshed.
+class PerceptualHashIndex:
+    def __init__(
+        self,
+        refresh_interval: float,
+        refresh_overlap: int = 10000,
+        initial_capacity: int = 1024,
+    ) -> None:
+        # numpy is slow to import, so it is only loaded once the index is
+        # created at startup.
+        import numpy
+
+        self.numpy = numpy
+        self.ids = numpy.empty(initial_capacity, dtype=numpy.int64)
+        self.hashes = numpy.empty(initial_capacity, dtype=numpy.uint64)
+        self.size = 0
+        self.refresh_interval = refresh_interval
+        self.refresh_lock = asyncio.Lock()
+        self.refreshed_at = float("-inf")
+        self.refresh_overlap = refresh_overlap
+        self.refreshed_id = 0
+        # Ids in the index that the next refresh loads again.
+        self.recent_ids: Set[int] = set()
+
+    def add(self, image_id: int, perceptual_hash: int) -> None:
+        if image_id in self.recent_ids:
+            return
+        self.append([image_id], [perceptual_hash])
+        if image_id > self.refreshed_id - self.refresh_overlap:
+            self.recent_ids.add(image_id)
+
+    def append(self, image_ids: List[int], perceptual_hashes: List[int]) -> None:
+        size = self.size + len(image_ids)
+        if size > len(self.ids):
+            capacity = max(size, len(self.ids) * 2)
+            self.ids = self.numpy.resize(self.ids, capacity)
+            self.hashes = self.numpy.resize(self.hashes, capacity)
+        self.ids[self.size : size] = image_ids
+        self.hashes[self.size : size] = [
+            value & UINT64_MASK for value in perceptual_hashes
+        ]
+        self.size = size
+
+    # Loads images with a higher id than any loaded before, unless the index
+    # was refreshed less than refresh_interval seconds ago. Ids come from a
+    # sequence when the row is inserted, so a transaction can commit a lower
+    # id after a higher one was loaded. The last refresh_overlap ids are
+    # loaded again to pick those up, and the ones already in the index are
+    # skipped.
+    async def refresh(
+        self,
+        load_after: Callable[[int], AsyncIterator[Mapping]],
+        force: bool = False,
+    ) -> None:
+        if not force and not self.is_stale():
+            return
+
+        async with self.refresh_lock:
+            if not force and not self.is_stale():
+                return
+
+            rows = [
+                (row["id"], row["perceptual_hash"])
+                async for row in load_after(
+                    max(0, self.refreshed_id - self.refresh_overlap)
+                )
+            ]
+            self.refreshed_at = time.monotonic()
+            new_rows = [row for row in rows if row[0] not in self.recent_ids]
+            self.append(
+                [image_id for image_id, _ in new_rows],
+                [perceptual_hash for _, perceptual_hash in new_rows],
+            )
+            if rows:
+                self.refreshed_id = max(self.refreshed_id, rows[-1][0])
+            self.recent_ids = {
+                image_id
+                for image_id in self.recent_ids.union(row[0] for row in new_rows)
+                if image_id > self.refreshed_id - self.refresh_overlap
+            }
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.refreshed_at >= self.refresh_interval
+
+    # Returns (image id, distance) pairs for the closest images, ordered by
+    # distance and then id.
+    def search(
+        self,
+        perceptual_hash: int,
+        max_distance: int,
+        limit: int,
+        exclude_id: int | None = None,
+    ) -> List[Tuple[int, int]]:
+        numpy = self.numpy
+        ids = self.ids[: self.size]
+        distances = numpy.bitwise_count(
+            self.hashes[: self.size] ^ numpy.uint64(perceptual_hash & UINT64_MASK)
+        )
+        # The image being compared is usually in the index too, so one more
+        # is looked for and it is left out at the end. An image can also be
+        # added by an insert and by a refresh at the same time, so there are
+        # at most two copies of each.
+        wanted = 2 * (limit + 1)
+
+        matches = distances <= max_distance
+        if numpy.count_nonzero(matches) > wanted:
+            # Finds the distance that covers enough images, so the sort below
+            # stays small when max_distance matches most of the index.
+            counts = numpy.cumsum(numpy.bincount(distances, minlength=65))
+            cutoff = int(numpy.searchsorted(counts, wanted))
+            matches = distances <= min(max_distance, cutoff)
+        matches = numpy.flatnonzero(matches)
+
+        # Ids are far below 2^56, so one int64 sorts by distance and then id.
+        keys = distances[matches].astype(numpy.int64) << 56 | ids[matches]
+        if len(keys) > wanted:
+            keys = keys[numpy.argpartition(keys, wanted)[:wanted]]
+        similar = [
+            (int(key & ((1 << 56) - 1)), int(key >> 56)) for key in numpy.unique(keys)
+        ]
+        return [match for match in similar if match[0] != exclude_id][:limit]
@@ -0,0 +1,137 @@
+from typing import AsyncIterator, Dict, List
+
+from fastapi import HTTPException
+from multipart.multipart import MultipartParser, parse_options_header
+
+from image_analysis_api.api.validators import image_is_allowable_size
+
+MAX_FIELD_SIZE = 1024
+MAX_MULTIPART_OVERHEAD = 64 * 1024
+
+
+def upload_is_allowable_size(content_length: str | None) -> bool:
+    if content_length is None:
+        return True
+    try:
+        size = int(content_length)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Content-Length must be an integer")
+    return image_is_allowable_size(size - MAX_MULTIPART_OVERHEAD)
+
+
+class ImageUpload:
+    def __init__(self) -> None:
+        self.fields: Dict[str, str] = {}
+        self.filename: str | None = None
+        self.content_type: str = ""
+        self.image_bytes: bytes = b""
+
+
+# Parses multipart/form-data as it streams in, so an oversized image is
+# rejected as soon as it passes the 4 MB limit instead of after a full read.
+class ImageUploadParser:
+    def __init__(self, content_type: str) -> None:
+        media_type, params = parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if media_type != b"multipart/form-data" or not boundary:
+            raise HTTPException(
+                status_code=400, detail="Request must be multipart/form-data"
+            )
+
+        self.upload = ImageUpload()
+        self.file_chunks: List[bytes] = []
+        self.file_size = 0
+        self.header_field = b""
+        self.header_value = b""
+        self.part_headers: Dict[bytes, bytes] = {}
+        self.part_name = ""
+        self.part_is_file = False
+        self.part_data = b""
+        self.finished = False
+        self.parser = MultipartParser(
+            boundary,
+            {
+                "on_part_begin": self.on_part_begin,
+                "on_part_data": self.on_part_data,
+                "on_part_end": self.on_part_end,
+                "on_header_field": self.on_header_field,
+                "on_header_value": self.on_header_value,
+                "on_header_end": self.on_header_end,
+                "on_headers_finished": self.on_headers_finished,
+                "on_end": self.on_end,
+            },
+        )
+
+    async def parse(self, stream: AsyncIterator[bytes]) -> ImageUpload:
+        async for chunk in stream:
+            self.parser.write(chunk)
+        self.parser.finalize()
+
+        # The parser accepts a body that stops before the closing boundary,
+        # which is what a client that disconnects midway sends.
+        if not self.finished:
+            raise HTTPException(status_code=400, detail="Request body is incomplete")
+        if self.upload.filename is None:
+            raise HTTPException(status_code=400, detail="Must provide an image file")
+
+        self.upload.image_bytes = b"".join(self.file_chunks)
+        return self.upload
+
+    def on_part_begin(self) -> None:
+        self.part_headers = {}
+        self.part_data = b""
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self.header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self.part_headers[self.header_field.lower()] = self.header_value
+        self.header_field = b""
+        self.header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(
+            self.part_headers.get(b"content-disposition", b"")
+        )
+        self.part_name = options.get(b"name", b"").decode("utf-8", "replace")
+        self.part_is_file = b"filename" in options
+        if self.part_is_file:
+            if self.upload.filename is not None:
+                raise HTTPException(
+                    status_code=400, detail="Only one image file can be uploaded"
+                )
+            self.upload.filename = options[b"filename"].decode("utf-8", "replace")
+            self.upload.content_type = self.part_headers.get(
+                b"content-type", b""
+            ).decode("latin-1")
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self.part_is_file:
+            self.file_size += end - start
+            if not image_is_allowable_size(self.file_size):
+                raise HTTPException(
+                    status_code=400, detail="Image must be smaller than 4 MB"
+                )
+            self.file_chunks.append(data[start:end])
+        else:
+            self.part_data += data[start:end]
+            if len(self.part_data) > MAX_FIELD_SIZE:
+                raise HTTPException(
+                    status_code=400, detail=f"{self.part_name} is too large"
+                )
+
+    def on_part_end(self) -> None:
+        if self.part_is_file:
+            return
+        try:
+            self.upload.fields[self.part_name] = self.part_data.decode("utf-8")
+        except UnicodeDecodeError:
+            raise HTTPException(
+                status_code=400, detail=f"{self.part_name} must be UTF-8 text"
+            )
+
+    def on_end(self) -> None:
+        self.finished = True
@@ -1,7 +1,11 @@
+import base64
+import binascii
+import io
 from typing import List
 from urllib.parse import urlparse
 
-from PIL import Image
+from fastapi import HTTPException
+from PIL import Image, UnidentifiedImageError
 
 """
 Image Analysis works on:
@@ -35,23 +39,56 @@ def image_is_allowable_size(image_size) -> bool:
     return image_size < 1024 * 1024 * 4
 
 
-# def validate_image_file(image_file: UploadFile) -> bool:
+def base64_decoded_size(image_data: str) -> int:
+    padding = len(image_data) - len(image_data.rstrip("="))
+    return len(image_data) * 3 // 4 - padding
 
-#     if not image_has_allowed_content_type(image_file.content_type):
-#         raise HTTPException(
-#             status_code=400,
-#             detail=f"{image_file.content_type} is an invalid content type. Must be one of {allowed_image_types}",
-#         )
 
-#     # if not image_is_allowable_size(len(image_file.file.read())):
-#     #     raise HTTPException(status_code=400, detail="Image must be smaller than 4 MB")
+def decode_image_data(image_data: str) -> bytes:
+    try:
+        return base64.b64decode(image_data, validate=True)
+    except binascii.Error:
+        raise HTTPException(
+            status_code=400, detail="image_data is not a valid base64 string"
+        )
 
-#     if not image_is_allowable_dimensions(Image.open(image_file.file)):
-#         raise HTTPException(
-#             status_code=400,
-#             detail=f"{image_file.filename} does not meet the minimum dimensions of 50 x 50",
-#         )
-#     return True
+
+def validate_image(
+    image_bytes: bytes, content_type: str | None, image_source: str
+) -> Image:
+    if content_type is not None and not image_has_allowed_content_type(content_type):
+        raise HTTPException(
+            status_code=400,
+            detail=f"{content_type} is an invalid content type. Must be one of {allowed_image_types}",
+        )
+
+    if not image_is_allowable_size(len(image_bytes)):
+        raise HTTPException(status_code=400, detail="Image must be smaller than 4 MB")
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+    except UnidentifiedImageError:
+        raise HTTPException(
+            status_code=400, detail=f"{image_source} is not a readable image"
+        )
+
+    # Pillow reports JPEGs with extra frames, which many cameras and phones
+    # write, as MPO.
+    image_format = "JPEG" if image.format == "MPO" else image.format
+    image_type = Image.MIME.get(image_format, image_format)
+    if not image_has_allowed_content_type(image_type):
+        raise HTTPException(
+            status_code=400,
+            detail=f"{image_type} is an invalid content type. Must be one of {allowed_image_types}",
+        )
+
+    if not image_is_allowable_dimensions(image):
+        raise HTTPException(
+            status_code=400,
+            detail=f"{image_source} does not meet the minimum dimensions of 50 x 50",
+        )
+
+    return image
 
 
 # def validate_image_url(image_url: str) -> bool:
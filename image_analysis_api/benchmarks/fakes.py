@@ -0,0 +1,101 @@
+import asyncio
+from decimal import Decimal
+from io import BytesIO
+import random
+import struct
+import threading
+from typing import List
+
+from aiohttp import web
+from PIL import Image
+
+from image_analysis_api.services.image_analyzers import Detection, ImageAnalyzer
+from image_analysis_api.services.storage_backends import StorageBackend
+
+
+async def simulate_latency(latency: float, jitter: float) -> None:
+    delay = latency + random.uniform(0, jitter)
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+# Stands in for Computer Vision, so the preprocessing before it still runs.
+class FakeImageAnalysisService(ImageAnalyzer):
+    def __init__(self, latency: float, jitter: float, objects: List[str]) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.objects = objects
+
+    async def detect_objects(
+        self, image_data: bytes, min_confidence: Decimal
+    ) -> List[Detection]:
+        await simulate_latency(self.latency, self.jitter)
+        return [Detection(label, 0.9, (0.1, 0.1, 0.5, 0.5)) for label in self.objects]
+
+
+# Only the blob upload is faked, so derivatives are still generated.
+class FakeStorageBackend(StorageBackend):
+    def __init__(self, latency: float, jitter: float) -> None:
+        self.latency = latency
+        self.jitter = jitter
+
+    async def save(
+        self, name: str, data: bytes, content_type: str | None = None
+    ) -> str:
+        await simulate_latency(self.latency, self.jitter)
+        return f"http://storage.invalid/images/{name}"
+
+
+def create_jpeg(width: int, height: int) -> bytes:
+    image = Image.effect_noise((width, height), 64).convert("RGB")
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=85)
+    return output.getvalue()
+
+
+def make_unique(jpeg: bytes, number: int) -> bytes:
+    # A JPEG comment segment right after the start of image marker changes the
+    # content hash without having to encode a new image for every request.
+    comment = f"image {number}".encode("ascii")
+    segment = b"\xff\xfe" + struct.pack(">H", len(comment) + 2) + comment
+    return jpeg[:2] + segment + jpeg[2:]
+
+
+# Serves a distinct copy of the same JPEG at /images/{number}.jpg, so that
+# every POST /images in a run is a new image rather than a duplicate.
+class ImageServer:
+    def __init__(self, host: str, port: int, width: int, height: int) -> None:
+        self.host = host
+        self.port = port
+        self.jpeg = create_jpeg(width, height)
+        self.loop = asyncio.new_event_loop()
+        self.runner: web.AppRunner | None = None
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="image-server", daemon=True
+        )
+
+    def image_url(self, number: int) -> str:
+        return f"http://{self.host}:{self.port}/images/{number}.jpg"
+
+    async def get_image(self, request: web.Request) -> web.Response:
+        number = int(request.match_info["number"])
+        return web.Response(
+            body=make_unique(self.jpeg, number), content_type="image/jpeg"
+        )
+
+    async def start_runner(self) -> None:
+        app = web.Application()
+        app.router.add_get(r"/images/{number:\d+}.jpg", self.get_image)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+
+    def start(self) -> None:
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.start_runner(), self.loop).result()
+
+    def stop(self) -> None:
+        if self.runner is not None:
+            asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
@@ -0,0 +1,306 @@
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+import aiohttp
+from sqlalchemy import create_engine, text
+
+from image_analysis_api.api.config import get_config
+from image_analysis_api.api.migrate import create_schema
+from image_analysis_api.benchmarks.fakes import ImageServer
+
+# Builds the method, path and JSON body of the next request in a scenario.
+RequestFactory = Callable[[int], Tuple[str, str, Dict[str, Any] | None]]
+
+
+class BenchmarkResult(NamedTuple):
+    scenario: str
+    concurrency: int
+    requests: int
+    errors: int
+    requests_per_second: float
+    p50: float
+    p95: float
+    p99: float
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = math.ceil(percent / 100 * len(sorted_values)) - 1
+    return sorted_values[max(index, 0)]
+
+
+def summarize(
+    scenario: str,
+    concurrency: int,
+    latencies: List[float],
+    errors: int,
+    duration: float,
+) -> BenchmarkResult:
+    latencies = sorted(latencies)
+    return BenchmarkResult(
+        scenario=scenario,
+        concurrency=concurrency,
+        requests=len(latencies),
+        errors=errors,
+        requests_per_second=len(latencies) / duration if duration else 0.0,
+        p50=percentile(latencies, 50) * 1000,
+        p95=percentile(latencies, 95) * 1000,
+        p99=percentile(latencies, 99) * 1000,
+    )
+
+
+async def run_scenario(
+    session: aiohttp.ClientSession,
+    base_url: str,
+    scenario: str,
+    make_request: RequestFactory,
+    concurrency: int,
+    total_requests: int,
+    on_response: Callable[[Dict[str, Any]], None] | None = None,
+) -> BenchmarkResult:
+    numbers = iter(range(total_requests))
+    latencies: List[float] = []
+    errors = 0
+
+    # A closed loop: each worker sends its next request once the last returns.
+    async def worker() -> None:
+        nonlocal errors
+        for number in numbers:
+            method, path, body = make_request(number)
+            started = time.perf_counter()
+            async with session.request(method, base_url + path, json=body) as resp:
+                payload = await resp.read()
+            latencies.append(time.perf_counter() - started)
+            if resp.status >= 400:
+                errors += 1
+            elif on_response is not None:
+                on_response(json.loads(payload))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(
+        scenario, concurrency, latencies, errors, time.perf_counter() - started
+    )
+
+
+async def run_benchmarks(
+    args: argparse.Namespace, base_url: str, image_server: ImageServer
+) -> List[BenchmarkResult]:
+    image_ids: List[int] = []
+    image_numbers = itertools.count(int(time.time() * 1000))
+
+    scenarios: Dict[str, RequestFactory] = {
+        "post_image": lambda _: (
+            "POST",
+            "/images",
+            {
+                "label": "benchmark",
+                "image_url": image_server.image_url(next(image_numbers)),
+                "analyze_image": True,
+            },
+        ),
+        "get_image": lambda _: ("GET", f"/images/{random.choice(image_ids)}", None),
+        "list_images": lambda _: ("GET", "/images?limit=100", None),
+        "list_images_by_object": lambda _: (
+            "GET",
+            "/images?objects=cat&limit=100",
+            None,
+        ),
+    }
+
+    results = []
+    connector = aiohttp.TCPConnector(limit=max(args.concurrency))
+    async with aiohttp.ClientSession(connector=connector) as session:
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                if scenario == "get_image" and not image_ids:
+                    image_ids.extend(await fetch_image_ids(session, base_url))
+                if scenario == "get_image" and not image_ids:
+                    print("Skipping get_image, there are no images", file=sys.stderr)
+                    continue
+                on_response = None
+                if scenario == "post_image":
+                    on_response = lambda image: image_ids.append(image["id"])
+
+                result = await run_scenario(
+                    session,
+                    base_url,
+                    scenario,
+                    scenarios[scenario],
+                    concurrency,
+                    args.requests,
+                    on_response,
+                )
+                results.append(result)
+                print(format_result(result), file=sys.stderr)
+    return results
+
+
+async def fetch_image_ids(session: aiohttp.ClientSession, base_url: str) -> List[int]:
+    async with session.get(f"{base_url}/images?fields=id&limit=1000") as response:
+        return [image["id"] for image in await response.json()]
+
+
+def prepare_database(truncate: bool) -> None:
+    connection_string = get_config().postgres_connection_string
+    create_schema(connection_string)
+    if truncate:
+        engine = create_engine(connection_string)
+        with engine.begin() as connection:
+            connection.execute(
+                text("TRUNCATE images, image_tags, jobs RESTART IDENTITY CASCADE")
+            )
+        engine.dispose()
+
+
+def start_api_server(args: argparse.Namespace) -> subprocess.Popen:
+    command = [
+        sys.executable,
+        "-m",
+        "image_analysis_api.benchmarks.server",
+        f"--port={args.api_port}",
+        f"--analysis-latency={args.analysis_latency}",
+        f"--analysis-jitter={args.analysis_jitter}",
+        f"--storage-latency={args.storage_latency}",
+        f"--storage-jitter={args.storage_jitter}",
+    ]
+    return subprocess.Popen(command)
+
+
+async def wait_until_ready(
+    base_url: str, server: subprocess.Popen, timeout: float
+) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError("The API server exited during startup")
+            try:
+                async with session.get(f"{base_url}/metrics") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"The API server did not start within {timeout}s")
+
+
+def format_header() -> str:
+    return (
+        f"{'scenario':<24}{'concurrency':>12}{'requests':>10}{'errors':>8}"
+        f"{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    )
+
+
+def format_result(result: BenchmarkResult) -> str:
+    return (
+        f"{result.scenario:<24}{result.concurrency:>12}{result.requests:>10}"
+        f"{result.errors:>8}{result.requests_per_second:>10.1f}{result.p50:>10.1f}"
+        f"{result.p95:>10.1f}{result.p99:>10.1f}"
+    )
+
+
+def compare(results: List[BenchmarkResult], baseline_path: str) -> None:
+    with open(baseline_path) as f:
+        baseline = {
+            (result["scenario"], result["concurrency"]): result
+            for result in json.load(f)["results"]
+        }
+
+    print(f"\nCompared to {baseline_path}:")
+    print(f"{'scenario':<24}{'concurrency':>12}{'req/s':>10}{'p95':>10}{'p99':>10}")
+    for result in results:
+        before = baseline.get((result.scenario, result.concurrency))
+        if before is None:
+            continue
+        changes = [
+            (getattr(result, field) - before[field]) / before[field] * 100
+            if before[field]
+            else 0.0
+            for field in ("requests_per_second", "p95", "p99")
+        ]
+        print(
+            f"{result.scenario:<24}{result.concurrency:>12}"
+            + "".join(f"{change:>+9.1f}%" for change in changes)
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Measure API throughput and latency with local stand-ins for Azure"
+    )
+    parser.add_argument(
+        "--scenarios",
+        type=lambda value: value.split(","),
+        default=["post_image", "get_image", "list_images", "list_images_by_object"],
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(level) for level in value.split(",")],
+        default=[1, 8, 32],
+    )
+    parser.add_argument(
+        "--requests", type=int, default=200, help="Requests per concurrency level"
+    )
+    parser.add_argument("--analysis-latency", type=float, default=0.2)
+    parser.add_argument("--analysis-jitter", type=float, default=0.05)
+    parser.add_argument("--storage-latency", type=float, default=0.05)
+    parser.add_argument("--storage-jitter", type=float, default=0.02)
+    parser.add_argument("--image-width", type=int, default=1280)
+    parser.add_argument("--image-height", type=int, default=960)
+    parser.add_argument("--api-port", type=int, default=8001)
+    parser.add_argument("--image-port", type=int, default=8002)
+    parser.add_argument(
+        "--truncate",
+        action="store_true",
+        help="Empty the images, image_tags and jobs tables before running",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with results from --output")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    prepare_database(args.truncate)
+
+    base_url = f"http://127.0.0.1:{args.api_port}"
+    image_server = ImageServer(
+        "127.0.0.1", args.image_port, args.image_width, args.image_height
+    )
+    image_server.start()
+    server = start_api_server(args)
+    try:
+        asyncio.run(wait_until_ready(base_url, server, timeout=30))
+        print(format_header(), file=sys.stderr)
+        results = asyncio.run(run_benchmarks(args, base_url, image_server))
+    finally:
+        server.terminate()
+        server.wait()
+        image_server.stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "settings": vars(args),
+                    "results": [result._asdict() for result in results],
+                },
+                f,
+                indent=2,
+            )
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import time
+from typing import Any, Callable, Dict, List
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import APIRoute, serialize_response
+
+from image_analysis_api.api.images_repo import rows_to_dicts
+from image_analysis_api.api.main import app, get_images
+from image_analysis_api.api.models import AnalyzedImage
+
+
+def create_rows(count: int) -> List[Dict[str, Any]]:
+    return [
+        dict(
+            id=image_id,
+            label=f"image {image_id}",
+            url=f"https://example.blob.core.windows.net/images/image-{image_id:064x}.jpeg",
+            analyze_image=True,
+            objects=["cat", "dog", "person"],
+            content_hash=f"{image_id:064x}",
+            derivatives={
+                "thumbnail": f"https://example.blob.core.windows.net/images/thumb-{image_id}.jpeg"
+            },
+            blob_name=f"image-{image_id:064x}.jpeg",
+        )
+        for image_id in range(count)
+    ]
+
+
+# What FastAPI does with the rows returned by GET /images when it validates
+# them against response_model and encodes them with the json module.
+def encode_with_response_model(rows: List[Dict[str, Any]]) -> bytes:
+    route = next(
+        route
+        for route in app.routes
+        if isinstance(route, APIRoute) and route.endpoint is get_images
+    )
+    content = asyncio.run(
+        serialize_response(field=route.response_field, response_content=rows)
+    )
+    return JSONResponse(content).body
+
+
+def encode_rows(rows: List[Dict[str, Any]]) -> bytes:
+    return ORJSONResponse(rows_to_dicts(rows, list(AnalyzedImage.__fields__))).body
+
+
+def measure(
+    encode: Callable[[List[Dict[str, Any]]], bytes], rows, repeat: int
+) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        encode(rows)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare the time taken to serialize image listings"
+    )
+    parser.add_argument(
+        "--rows",
+        type=lambda value: [int(count) for count in value.split(",")],
+        default=[1000, 10000, 100000],
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Runs per size, the fastest is kept"
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    print(f"{'rows':>8}{'response_model':>18}{'direct':>12}{'speedup':>10}")
+    for count in args.rows:
+        rows = create_rows(count)
+        before = measure(encode_with_response_model, rows, args.repeat)
+        after = measure(encode_rows, rows, args.repeat)
+        print(
+            f"{count:>8}{before * 1000:>16.1f}ms{after * 1000:>10.1f}ms"
+            f"{before / after:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import argparse
+
+import uvicorn
+
+from image_analysis_api.api import dependencies
+from image_analysis_api.api.config import get_config
+from image_analysis_api.api.main import app
+from image_analysis_api.benchmarks.fakes import (
+    FakeImageAnalysisService,
+    FakeStorageBackend,
+)
+
+
+async def install_fakes(args: argparse.Namespace) -> None:
+    services = dependencies.services
+    services.image_analysis_service.close()
+    services.image_analysis_service = FakeImageAnalysisService(
+        args.analysis_latency, args.analysis_jitter, ["cat", "dog"]
+    )
+    # With STORAGE_BACKEND=local the real local backend is benchmarked.
+    if get_config().storage_backend == "azure":
+        await services.image_storage_service.close()
+        services.image_storage_service.backend = FakeStorageBackend(
+            args.storage_latency, args.storage_jitter
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Run the API with local stand-ins for Azure"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--analysis-latency", type=float, default=0.2)
+    parser.add_argument("--analysis-jitter", type=float, default=0.05)
+    parser.add_argument("--storage-latency", type=float, default=0.05)
+    parser.add_argument("--storage-jitter", type=float, default=0.02)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    # Runs after the app's own startup, once the real services exist.
+    @app.on_event("startup")
+    async def use_fakes():
+        await install_fakes(args)
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
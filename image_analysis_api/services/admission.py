@@ -0,0 +1,277 @@
+from abc import ABC, abstractmethod
+import asyncio
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, List, TypeVar
+
+from fastapi import HTTPException
+
+from image_analysis_api.api.metrics import Counter, Gauge
+
+T = TypeVar("T")
+
+concurrency_limit = Gauge(
+    "image_analysis_admission_concurrency_limit",
+    "Current adaptive limit on concurrent analysis calls",
+)
+admitted_in_flight = Gauge(
+    "image_analysis_admission_in_flight", "Analysis calls currently admitted"
+)
+admission_queued = Gauge(
+    "image_analysis_admission_queued", "Analysis calls waiting to be admitted"
+)
+admission_rejections = Counter(
+    "image_analysis_admission_rejections_total",
+    "Analysis calls rejected because they could not be admitted in time",
+    ["reason"],
+)
+
+
+class AdmissionRejected(HTTPException):
+    pass
+
+
+class TokenBucket(ABC):
+    # Takes a token if one is available and returns 0, otherwise returns how
+    # many seconds until the next token without taking one.
+    @abstractmethod
+    async def try_acquire(self) -> float:
+        ...
+
+    def state(self) -> Dict[str, Any]:
+        return {}
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemoryTokenBucket(TokenBucket):
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    async def try_acquire(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def state(self) -> Dict[str, Any]:
+        return {"rate": self.rate, "burst": self.burst, "tokens": self.tokens}
+
+
+# Refills and takes tokens in one script, using the Redis server's clock, so
+# every worker process shares the same quota.
+TAKE_TOKEN_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisTokenBucket(TokenBucket):
+    def __init__(self, url: str, key: str, rate: float, burst: int) -> None:
+        # redis is an optional dependency, only needed for a shared quota.
+        from redis.asyncio import Redis
+
+        self.client = Redis.from_url(url)
+        self.take_token = self.client.register_script(TAKE_TOKEN_SCRIPT)
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+
+    async def try_acquire(self) -> float:
+        wait = await self.take_token(keys=[self.key], args=[self.rate, self.burst])
+        return float(wait)
+
+    def state(self) -> Dict[str, Any]:
+        return {"rate": self.rate, "burst": self.burst, "shared": True}
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+# Additive increase, multiplicative decrease: the limit grows by about one for
+# every limit's worth of fast calls, and is cut when Azure answers with 429 or
+# latency rises well above the fastest recently seen.
+class AIMDLimiter:
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        latency_tolerance: float,
+        backoff_ratio: float = 0.5,
+    ) -> None:
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+        self.in_flight = 0
+        self.waiters: List[asyncio.Future] = []
+        self.baseline_latency: float | None = None
+        self.last_decrease = 0.0
+        concurrency_limit.set(self.limit)
+
+    async def acquire(self, timeout: float) -> bool:
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.start()
+            return True
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        admission_queued.inc()
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(None, False)
+            raise
+        finally:
+            admission_queued.dec()
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+        return True
+
+    def start(self) -> None:
+        self.in_flight += 1
+        admitted_in_flight.inc()
+
+    def release(self, latency: float | None, overloaded: bool) -> None:
+        self.in_flight -= 1
+        admitted_in_flight.dec()
+
+        if latency is not None:
+            if self.baseline_latency is None or latency < self.baseline_latency:
+                self.baseline_latency = latency
+            else:
+                # Drifts up slowly, so the baseline follows lasting changes.
+                self.baseline_latency += (latency - self.baseline_latency) * 0.01
+
+        slow = (
+            latency is not None
+            and latency > self.baseline_latency * self.latency_tolerance
+        )
+        if overloaded or slow:
+            self.decrease()
+        elif latency is not None and self.in_flight + 1 >= int(self.limit):
+            # Only grow while the limit is actually being used.
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        concurrency_limit.set(self.limit)
+        self.wake_waiters()
+
+    def decrease(self) -> None:
+        # Calls that were already in flight report the same overload, so the
+        # limit is cut at most once per typical call duration.
+        now = time.monotonic()
+        if now - self.last_decrease < (self.baseline_latency or 0):
+            return
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+
+    def wake_waiters(self) -> None:
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.pop(0)
+            if not waiter.done():
+                self.start()
+                waiter.set_result(None)
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": len(self.waiters),
+            "baseline_latency": self.baseline_latency,
+        }
+
+
+# Admits calls when both a token and a concurrency slot are free within
+# max_wait seconds, and fails fast with a 503 otherwise.
+class AdmissionController:
+    def __init__(
+        self,
+        limiter: AIMDLimiter,
+        token_bucket: TokenBucket | None,
+        max_wait: float,
+        is_overload: Callable[[BaseException], bool],
+    ) -> None:
+        self.limiter = limiter
+        self.token_bucket = token_bucket
+        self.max_wait = max_wait
+        self.is_overload = is_overload
+
+    async def run(self, operation: Callable[[], Awaitable[T]]) -> T:
+        deadline = time.monotonic() + self.max_wait
+        # The slot is taken first, so a call rejected for concurrency does not
+        # use up quota.
+        if not await self.limiter.acquire(self.max_wait):
+            self.reject("concurrency", self.limiter.baseline_latency or 1)
+
+        if self.token_bucket is not None:
+            try:
+                await self.take_token(deadline)
+            except BaseException:
+                self.limiter.release(None, False)
+                raise
+
+        started = time.monotonic()
+        try:
+            result = await operation()
+        except Exception as e:
+            self.limiter.release(None, self.is_overload(e))
+            raise
+        except BaseException:
+            self.limiter.release(None, False)
+            raise
+        self.limiter.release(time.monotonic() - started, False)
+        return result
+
+    async def take_token(self, deadline: float) -> None:
+        while True:
+            wait = await self.token_bucket.try_acquire()
+            if wait == 0:
+                return
+            if time.monotonic() + wait > deadline:
+                self.reject("rate", wait)
+            await asyncio.sleep(wait)
+
+    def reject(self, reason: str, retry_after: float) -> None:
+        admission_rejections.inc(reason)
+        raise AdmissionRejected(
+            status_code=503,
+            detail="Image analysis is at capacity, try again later",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.limiter.state(),
+            "rate": self.token_bucket.state() if self.token_bucket else None,
+            "max_wait": self.max_wait,
+        }
+
+    async def close(self) -> None:
+        if self.token_bucket is not None:
+            await self.token_bucket.close()
@@ -1,31 +1,117 @@
+import asyncio
+from concurrent.futures import Executor
 from decimal import Decimal
 from io import BytesIO
-from typing import List
+from typing import Any, List, Tuple
 
-from azure.cognitiveservices.vision.computervision import ComputerVisionClient
-from azure.cognitiveservices.vision.computervision.models import VisualFeatureTypes
-from msrest.authentication import CognitiveServicesCredentials
+from image_analysis_api.services.image_analyzers import Detection, ImageAnalyzer
+from image_analysis_api.services.resilience import (
+    RETRYABLE_STATUS_CODES,
+    ResilientCaller,
+)
 
 
-class ImageAnalysisService:
-    def __init__(self, endpoint: str, api_key: str) -> None:
-        self.endpoint = endpoint
-        self.api_key = api_key
+class ImageAnalysisService(ImageAnalyzer):
+    def __init__(
+        self,
+        endpoint: str,
+        api_key: str,
+        executor: Executor,
+        caller: ResilientCaller,
+    ) -> None:
+        # The Azure SDK is slow to import, so it is only loaded once the
+        # service is created at startup.
+        from azure.cognitiveservices.vision.computervision import ComputerVisionClient
+        from azure.cognitiveservices.vision.computervision.models import (
+            VisualFeatureTypes,
+        )
+        from msrest.authentication import CognitiveServicesCredentials
 
-    def detect_objects(
-        self, image_data: bytes, acceptable_confidence_score: Decimal
-    ) -> List[str]:
-        computervision_client = ComputerVisionClient(
-            endpoint=self.endpoint,
-            credentials=CognitiveServicesCredentials(self.api_key),
+        self.visual_features = [VisualFeatureTypes.objects]
+        self.executor = executor
+        self.caller = caller
+        self.computervision_client = ComputerVisionClient(
+            endpoint=endpoint,
+            credentials=CognitiveServicesCredentials(api_key),
         )
-        analysis_response = computervision_client.analyze_image_in_stream(
-            BytesIO(image_data), [VisualFeatureTypes.objects]
+        # Retries and deadlines are handled by the caller. The SDK timeout
+        # also frees the executor thread once the deadline has passed.
+        self.computervision_client.config.retry_policy.retries = 0
+        self.computervision_client.config.connection.timeout = caller.timeout
+
+    def close(self) -> None:
+        self.computervision_client.close()
+
+    async def detect_objects(
+        self, image_data: bytes, min_confidence: Decimal
+    ) -> List[Detection]:
+        loop = asyncio.get_running_loop()
+        return await self.caller.call(
+            lambda: loop.run_in_executor(
+                self.executor,
+                self._detect_objects,
+                image_data,
+                min_confidence,
+            )
         )
 
-        objects = [
-            obj.object_property
+    def _detect_objects(
+        self, image_data: bytes, min_confidence: Decimal
+    ) -> List[Detection]:
+        analysis_response = self.computervision_client.analyze_image_in_stream(
+            BytesIO(image_data), self.visual_features
+        )
+
+        width = analysis_response.metadata.width
+        height = analysis_response.metadata.height
+        detections = [
+            Detection(
+                label=obj.object_property,
+                confidence=obj.confidence,
+                box=(
+                    obj.rectangle.x / width,
+                    obj.rectangle.y / height,
+                    obj.rectangle.w / width,
+                    obj.rectangle.h / height,
+                ),
+                parents=get_parents(obj),
+            )
             for obj in analysis_response.objects
-            if Decimal(obj.confidence) > acceptable_confidence_score
+            if Decimal(obj.confidence) > min_confidence
         ]
-        return objects
+        return detections
+
+
+def get_parents(obj: Any) -> List[Tuple[str, float]]:
+    parents = []
+    parent = obj.parent
+    while parent is not None:
+        parents.append((parent.object_property, parent.confidence))
+        parent = parent.parent
+    return parents
+
+
+def is_transient_error(error: BaseException) -> bool:
+    from msrest.exceptions import ClientRequestError, HttpOperationError
+
+    if isinstance(error, ClientRequestError):
+        return True
+    return (
+        isinstance(error, HttpOperationError)
+        and error.response is not None
+        and error.response.status_code in RETRYABLE_STATUS_CODES
+    )
+
+
+# Computer Vision answering 429 or 503, or an attempt timing out, means it is
+# getting more requests than it can take.
+def is_overload_error(error: BaseException) -> bool:
+    from msrest.exceptions import HttpOperationError
+
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    return (
+        isinstance(error, HttpOperationError)
+        and error.response is not None
+        and error.response.status_code in (429, 503)
+    )
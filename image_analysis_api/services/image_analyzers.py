@@ -0,0 +1,40 @@
+from abc import ABC, abstractmethod
+from decimal import Decimal
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+
+class Detection(NamedTuple):
+    label: str
+    confidence: float
+    # x, y, width and height as fractions of the image's width and height.
+    box: Tuple[float, float, float, float] | None = None
+    # Broader labels with their confidence, closest first, e.g. mammal and
+    # then animal for a dog.
+    parents: List[Tuple[str, float]] = []
+
+    # Rounded, and without empty fields, since every detection is stored.
+    def to_dict(self) -> Dict[str, Any]:
+        detection: Dict[str, Any] = {
+            "label": self.label,
+            "confidence": round(self.confidence, 4),
+        }
+        if self.box is not None:
+            detection["box"] = [round(value, 4) for value in self.box]
+        if self.parents:
+            detection["parents"] = [
+                {"label": label, "confidence": round(confidence, 4)}
+                for label, confidence in self.parents
+            ]
+        return detection
+
+
+class ImageAnalyzer(ABC):
+    # Returns every detection with a confidence above min_confidence.
+    @abstractmethod
+    async def detect_objects(
+        self, image_data: bytes, min_confidence: Decimal
+    ) -> List[Detection]:
+        ...
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,85 @@
+import asyncio
+from typing import TYPE_CHECKING, Tuple
+
+from fastapi import HTTPException
+
+from image_analysis_api.api.validators import image_is_allowable_size
+
+if TYPE_CHECKING:
+    import aiohttp
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class ImageDownloadService:
+    def __init__(
+        self,
+        max_connections: int,
+        max_connections_per_host: int,
+        connect_timeout: float,
+        read_timeout: float,
+        total_timeout: float,
+    ) -> None:
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.session: "aiohttp.ClientSession | None" = None
+
+    async def open(self) -> None:
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_connections_per_host,
+        )
+        # The total bounds the whole download, since a server that sends a
+        # byte before each read timeout would otherwise hold it forever.
+        timeout = aiohttp.ClientTimeout(
+            total=self.total_timeout,
+            sock_connect=self.connect_timeout,
+            sock_read=self.read_timeout,
+        )
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def download_image(self, image_url: str) -> Tuple[bytes, str]:
+        import aiohttp
+
+        try:
+            async with self.session.get(image_url) as response:
+                if not response.ok:
+                    raise HTTPException(
+                        status_code=400, detail=f"{image_url} does not exist"
+                    )
+
+                if response.content_length is not None and not image_is_allowable_size(
+                    response.content_length
+                ):
+                    raise HTTPException(
+                        status_code=400, detail="Image must be smaller than 4 MB"
+                    )
+
+                chunks = []
+                downloaded = 0
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    downloaded += len(chunk)
+                    if not image_is_allowable_size(downloaded):
+                        raise HTTPException(
+                            status_code=400, detail="Image must be smaller than 4 MB"
+                        )
+                    chunks.append(chunk)
+
+                content_type = response.headers.get("Content-Type", "")
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            raise HTTPException(
+                status_code=400,
+                detail=f"An error occured accessing the image at {image_url}",
+            )
+
+        return b"".join(chunks), content_type
@@ -0,0 +1,94 @@
+import asyncio
+from concurrent.futures import Executor
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# Computer Vision rejects images that are not larger than 50 x 50 pixels.
+MIN_ANALYSIS_DIMENSION = 51
+
+PERCEPTUAL_HASH_SIZE = 8
+
+
+class ImagePreprocessingService:
+    def __init__(
+        self, max_dimension: int, jpeg_quality: int, executor: Executor
+    ) -> None:
+        self.max_dimension = max_dimension
+        self.jpeg_quality = jpeg_quality
+        self.executor = executor
+
+    async def prepare_for_analysis(
+        self, image_bytes: bytes, image: Image.Image
+    ) -> bytes:
+        if not self.should_downscale(image):
+            return image_bytes
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor,
+            downscale_image,
+            image_bytes,
+            self.max_dimension,
+            self.jpeg_quality,
+        )
+
+    async def compute_perceptual_hash(self, image_bytes: bytes) -> int:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, perceptual_hash, image_bytes)
+
+    def should_downscale(self, image: Image.Image) -> bool:
+        if self.max_dimension <= 0:
+            return False
+
+        width, height = image.size
+        if max(width, height) <= self.max_dimension:
+            return False
+
+        scale = self.max_dimension / max(width, height)
+        return min(width, height) * scale >= MIN_ANALYSIS_DIMENSION
+
+
+def downscale_image(image_bytes: bytes, max_dimension: int, jpeg_quality: int) -> bytes:
+    image = Image.open(BytesIO(image_bytes))
+    if image.format == "JPEG":
+        # Let the JPEG decoder scale by 1/2, 1/4 or 1/8 while decoding.
+        image.draft("RGB", (max_dimension, max_dimension))
+    else:
+        # Palette and bilevel images cannot be reduced, and would otherwise be
+        # resized by picking the nearest pixel.
+        if image.mode in ("1", "P", "I;16"):
+            image = image.convert("RGB")
+        factor = max(image.size) // max_dimension
+        if factor > 1:
+            image = image.reduce(factor)
+
+    # Converting and rotating after shrinking only touches the pixels that are
+    # kept. The copy is saved without EXIF, so it is rotated upright here.
+    image.thumbnail((max_dimension, max_dimension))
+    image = ImageOps.exif_transpose(image).convert("RGB")
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=jpeg_quality)
+    return output.getvalue()
+
+
+# A 64 bit difference hash: each bit says whether a pixel of a 9 x 8 grayscale
+# thumbnail is brighter than the one to its right, so resized and re-encoded
+# copies of an image get the same or a nearby hash. It is returned as a signed
+# integer so it fits in a Postgres BIGINT.
+def perceptual_hash(image_bytes: bytes) -> int:
+    image = Image.open(BytesIO(image_bytes))
+    if image.format == "JPEG":
+        image.draft("L", (PERCEPTUAL_HASH_SIZE + 1, PERCEPTUAL_HASH_SIZE))
+    image = image.convert("L").resize(
+        (PERCEPTUAL_HASH_SIZE + 1, PERCEPTUAL_HASH_SIZE), Image.BILINEAR
+    )
+
+    pixels = image.tobytes()
+    value = 0
+    for row in range(PERCEPTUAL_HASH_SIZE):
+        offset = row * (PERCEPTUAL_HASH_SIZE + 1)
+        for column in range(PERCEPTUAL_HASH_SIZE):
+            left, right = pixels[offset + column], pixels[offset + column + 1]
+            value = value << 1 | (left > right)
+    return value - (1 << 64) if value >= 1 << 63 else value
@@ -1,17 +1,118 @@
+import asyncio
+from concurrent.futures import Executor
 from io import BytesIO
-from azure.storage.blob import BlobServiceClient, BlobClient
+import logging
+import time
+from typing import Dict, NamedTuple, Tuple
+
+from PIL import Image, ImageOps
+
+from image_analysis_api.api.metrics import track
+from image_analysis_api.services.resilience import ResilientCaller
+from image_analysis_api.services.storage_backends import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+
+class StoredImage(NamedTuple):
+    url: str
+    derivatives: Dict[str, str]
 
 
 class ImageStorageService:
-    def __init__(self, connection_string: str) -> None:
-        self.connection_string = connection_string
+    def __init__(
+        self,
+        backend: StorageBackend,
+        derivative_sizes: Dict[str, int],
+        derivative_format: str,
+        derivative_quality: int,
+        derivative_executor: Executor,
+        caller: ResilientCaller,
+    ) -> None:
+        self.backend = backend
+        self.caller = caller
+        self.derivative_sizes = derivative_sizes
+        self.derivative_format = derivative_format
+        self.derivative_quality = derivative_quality
+        self.derivative_executor = derivative_executor
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+    async def store_image(self, image_name: str, image_data: bytes) -> StoredImage:
+        url, derivatives = await asyncio.gather(
+            self.upload_image(image_name, image_data),
+            self.upload_derivatives(image_name, image_data),
+        )
+        return StoredImage(url, derivatives)
+
+    async def upload_image(
+        self, image_name: str, image_data: bytes, content_type: str | None = None
+    ) -> str:
+        with track("upload_image"):
+            # Image names are derived from their content, so saving one again
+            # is idempotent and safe to retry or hedge.
+            return await self.caller.call(
+                lambda: self.backend.save(image_name, image_data, content_type)
+            )
 
-    def upload_image(self, image_name: str, image_data: bytes) -> str:
-        blob_service_client = BlobServiceClient.from_connection_string(
-            self.connection_string
+    async def upload_derivatives(
+        self, image_name: str, image_data: bytes
+    ) -> Dict[str, str]:
+        if not self.derivative_sizes:
+            return {}
+
+        loop = asyncio.get_running_loop()
+        with track("derivatives"):
+            derivatives, cpu_seconds = await loop.run_in_executor(
+                self.derivative_executor,
+                generate_derivatives,
+                image_data,
+                self.derivative_sizes,
+                self.derivative_format,
+                self.derivative_quality,
+            )
+        logger.debug(
+            "Generated derivatives of %s in %.3fs CPU", image_name, cpu_seconds
         )
-        blob_client: BlobClient = blob_service_client.get_blob_client(
-            container="images", blob=image_name
+
+        base_name = image_name.rsplit(".", 1)[0]
+        content_type = f"image/{self.derivative_format}"
+        names = list(derivatives)
+        urls = await asyncio.gather(
+            *(
+                self.upload_image(
+                    f"{base_name}-{name}.{self.derivative_format}",
+                    derivatives[name],
+                    content_type,
+                )
+                for name in names
+            )
         )
-        blob_client.upload_blob(BytesIO(image_data))
-        return blob_client.url
+        return dict(zip(names, urls))
+
+
+# Runs in a worker process, so it only takes and returns picklable values.
+def generate_derivatives(
+    image_data: bytes, sizes: Dict[str, int], image_format: str, quality: int
+) -> Tuple[Dict[str, bytes], float]:
+    started = time.process_time()
+    image = Image.open(BytesIO(image_data))
+    largest_size = max(sizes.values())
+    if image.format == "JPEG":
+        image.draft("RGB", (largest_size, largest_size))
+    # Rotates photos taken sideways upright, since the derivatives are saved
+    # without the EXIF orientation tag.
+    image = ImageOps.exif_transpose(image)
+    # Only WebP keeps transparency, and only images that have it get an alpha
+    # channel, since it makes opaque derivatives larger for nothing.
+    has_alpha = "A" in image.getbands() or "transparency" in image.info
+    image = image.convert("RGBA" if image_format == "webp" and has_alpha else "RGB")
+
+    derivatives = {}
+    for name, size in sorted(sizes.items(), key=lambda item: -item[1]):
+        image.thumbnail((size, size))
+        output = BytesIO()
+        image.save(output, format=image_format.upper(), quality=quality)
+        derivatives[name] = output.getvalue()
+    return derivatives, time.process_time() - started
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+from concurrent.futures import Executor
+from decimal import Decimal
+from io import BytesIO
+from typing import Any, List, Tuple
+
+from fastapi import HTTPException
+from PIL import Image
+
+from image_analysis_api.api.metrics import Histogram
+from image_analysis_api.services.image_analyzers import Detection, ImageAnalyzer
+
+# ImageNet statistics, which most pretrained vision models are normalized with.
+CHANNEL_MEAN = (0.485, 0.456, 0.406)
+CHANNEL_STD = (0.229, 0.224, 0.225)
+
+inference_batch_size = Histogram(
+    "image_analysis_local_batch_size",
+    "Images per inference call of the local analyzer",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+logger = logging.getLogger(__name__)
+
+PendingImage = Tuple[bytes, float, "asyncio.Future[List[Detection]]"]
+
+
+# Runs a user supplied ONNX multi-label model on CPU. Concurrent requests are
+# queued for up to batch_max_wait seconds and sent to the process pool as a
+# single batch, so they share one vectorized inference call.
+class LocalImageAnalyzer(ImageAnalyzer):
+    def __init__(
+        self,
+        input_size: int,
+        batch_max_size: int,
+        batch_max_wait: float,
+        max_concurrent_batches: int,
+        executor: Executor,
+    ) -> None:
+        self.input_size = input_size
+        self.batch_max_size = batch_max_size
+        self.batch_max_wait = batch_max_wait
+        self.max_concurrent_batches = max_concurrent_batches
+        self.executor = executor
+        self.pending: List[PendingImage] = []
+        self.has_pending: asyncio.Event | None = None
+        self.batch_full: asyncio.Event | None = None
+        self.batcher: asyncio.Task | None = None
+
+    def close(self) -> None:
+        if self.batcher is not None:
+            self.batcher.cancel()
+            self.batcher = None
+
+    async def detect_objects(
+        self, image_data: bytes, min_confidence: Decimal
+    ) -> List[Detection]:
+        if self.batcher is None:
+            self.has_pending = asyncio.Event()
+            self.batch_full = asyncio.Event()
+            self.batcher = asyncio.create_task(
+                self.run_batcher(), name="local-image-analyzer"
+            )
+
+        result = asyncio.get_running_loop().create_future()
+        self.pending.append((image_data, float(min_confidence), result))
+        self.has_pending.set()
+        if len(self.pending) >= self.batch_max_size:
+            self.batch_full.set()
+        return await result
+
+    async def run_batcher(self) -> None:
+        # Waiting for a free slot before collecting lets batches grow while
+        # every worker process is busy.
+        slots = asyncio.Semaphore(self.max_concurrent_batches)
+        while True:
+            await slots.acquire()
+            await self.has_pending.wait()
+            if len(self.pending) < self.batch_max_size:
+                try:
+                    await asyncio.wait_for(self.batch_full.wait(), self.batch_max_wait)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self.pending[: self.batch_max_size]
+            self.pending = self.pending[self.batch_max_size :]
+            if not self.pending:
+                self.has_pending.clear()
+            if len(self.pending) < self.batch_max_size:
+                self.batch_full.clear()
+
+            task = asyncio.create_task(self.run_batch(batch))
+            task.add_done_callback(lambda _: slots.release())
+
+    async def run_batch(self, batch: List[PendingImage]) -> None:
+        inference_batch_size.observe(len(batch))
+        loop = asyncio.get_running_loop()
+        try:
+            detections = await loop.run_in_executor(
+                self.executor,
+                detect_objects_in_batch,
+                [image_data for image_data, _, _ in batch],
+                [score for _, score, _ in batch],
+                self.input_size,
+            )
+        except Exception as e:
+            for _, _, result in batch:
+                if not result.done():
+                    result.set_exception(e)
+            return
+
+        for (_, _, result), image_detections in zip(batch, detections):
+            if result.done():
+                continue
+            if image_detections is None:
+                result.set_exception(
+                    HTTPException(
+                        status_code=400, detail="The image could not be decoded"
+                    )
+                )
+            else:
+                result.set_result(image_detections)
+
+
+# The functions below run in the worker processes. Each one loads the model
+# once, when the process starts.
+model: Any = None
+labels: List[str] = []
+
+
+def load_model(model_path: str, labels_path: str) -> None:
+    global model, labels
+    # onnxruntime is an optional dependency, only needed when the local
+    # analyzer is used.
+    import onnxruntime
+
+    model = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+    with open(labels_path) as f:
+        labels = [line.strip() for line in f if line.strip()]
+
+
+# Images that cannot be decoded get None instead of detections, so one broken
+# upload does not fail the rest of its batch.
+def detect_objects_in_batch(
+    images: List[bytes], min_confidences: List[float], input_size: int
+) -> List[List[Detection] | None]:
+    import numpy
+
+    inputs = {}
+    for position, image in enumerate(images):
+        try:
+            inputs[position] = to_model_input(image, input_size)
+        except Exception:
+            logger.exception("Failed to decode image for analysis")
+
+    detections: List[List[Detection] | None] = [None] * len(images)
+    if not inputs:
+        return detections
+
+    pixels = numpy.stack(list(inputs.values()))
+    scores = model.run(None, {model.get_inputs()[0].name: pixels})[0]
+    for position, image_scores in zip(inputs, scores):
+        ranked = sorted(enumerate(image_scores), key=lambda item: -item[1])
+        detections[position] = [
+            Detection(labels[index], float(score))
+            for index, score in ranked
+            if score > min_confidences[position]
+        ]
+    return detections
+
+
+def to_model_input(image_data: bytes, input_size: int) -> Any:
+    import numpy
+
+    image = Image.open(BytesIO(image_data))
+    if image.format == "JPEG":
+        image.draft("RGB", (input_size, input_size))
+    image = image.convert("RGB").resize((input_size, input_size), Image.BILINEAR)
+
+    pixels = numpy.asarray(image, dtype=numpy.float32) / 255
+    pixels = (pixels - CHANNEL_MEAN) / CHANNEL_STD
+    return pixels.transpose(2, 0, 1).astype(numpy.float32)
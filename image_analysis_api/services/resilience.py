@@ -0,0 +1,228 @@
+import asyncio
+from collections import deque
+import math
+import random
+import time
+from typing import Awaitable, Callable, Deque, TypeVar
+
+from fastapi import HTTPException
+
+from image_analysis_api.api.metrics import Counter, Gauge
+from image_analysis_api.services.admission import AdmissionController, AdmissionRejected
+
+T = TypeVar("T")
+
+dependency_calls = Counter(
+    "image_analysis_dependency_calls_total",
+    "Attempts at calling an external dependency, by outcome",
+    ["dependency", "outcome"],
+)
+dependency_retries = Counter(
+    "image_analysis_dependency_retries_total",
+    "Calls to an external dependency that were retried",
+    ["dependency"],
+)
+dependency_hedges = Counter(
+    "image_analysis_dependency_hedges_total",
+    "Hedged second requests sent to an external dependency",
+    ["dependency"],
+)
+circuit_state = Gauge(
+    "image_analysis_circuit_state",
+    "Circuit breaker state: 0 closed, 1 half open, 2 open",
+    ["dependency"],
+)
+
+CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def is_timeout(error: BaseException) -> bool:
+    return isinstance(error, asyncio.TimeoutError)
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        circuit_state.set(CLOSED, name)
+
+    def before_call(self) -> None:
+        if self.state == OPEN:
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                self.reject(remaining)
+            self.set_state(HALF_OPEN)
+
+        # Only one call at a time tests whether the dependency has recovered.
+        if self.state == HALF_OPEN:
+            if self.probing:
+                self.reject(self.reset_timeout)
+            self.probing = True
+
+    def reject(self, retry_after: float) -> None:
+        dependency_calls.inc(self.name, "rejected")
+        raise HTTPException(
+            status_code=503,
+            detail=f"{self.name} is temporarily unavailable",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.probing = False
+        if self.state != CLOSED:
+            self.set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self.set_state(OPEN)
+
+    def set_state(self, state: int) -> None:
+        self.state = state
+        circuit_state.set(state, self.name)
+
+
+# Tracks recent latencies so hedged requests are only sent for calls that are
+# already slower than most.
+class LatencyTracker:
+    def __init__(self, percentile: float, min_samples: int) -> None:
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.samples: Deque[float] = deque(maxlen=1000)
+        self.threshold: float | None = None
+        self.samples_since_update = 0
+
+    def record(self, latency: float) -> None:
+        self.samples.append(latency)
+        self.samples_since_update += 1
+        if len(self.samples) >= self.min_samples and (
+            self.threshold is None or self.samples_since_update >= 50
+        ):
+            ordered = sorted(self.samples)
+            index = math.ceil(self.percentile / 100 * len(ordered)) - 1
+            self.threshold = ordered[max(index, 0)]
+            self.samples_since_update = 0
+
+
+# Wraps calls to an external dependency with a deadline per attempt, retries
+# with jittered exponential backoff for transient errors, an optional hedged
+# second request and a circuit breaker. Only idempotent operations should be
+# retried or hedged. With an admission controller, every attempt and hedged
+# request is admitted on its own, so each one is charged to the quota.
+class ResilientCaller:
+    def __init__(
+        self,
+        name: str,
+        timeout: float,
+        max_attempts: int,
+        backoff_base: float,
+        backoff_max: float,
+        hedge_percentile: float | None,
+        hedge_min_samples: int,
+        circuit_failure_threshold: int,
+        circuit_reset_timeout: float,
+        is_transient: Callable[[BaseException], bool] = is_timeout,
+        admission: AdmissionController | None = None,
+    ) -> None:
+        self.name = name
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.is_transient = is_transient
+        self.admission = admission
+        self.latencies = (
+            LatencyTracker(hedge_percentile, hedge_min_samples)
+            if hedge_percentile
+            else None
+        )
+        self.breaker = CircuitBreaker(
+            name, circuit_failure_threshold, circuit_reset_timeout
+        )
+
+    async def call(self, operation: Callable[[], Awaitable[T]]) -> T:
+        attempt = 1
+        while True:
+            self.breaker.before_call()
+            try:
+                result = await self.attempt(operation)
+            except (asyncio.CancelledError, AdmissionRejected):
+                # Nothing was sent, so the dependency's health is unknown.
+                self.breaker.probing = False
+                raise
+            except Exception as e:
+                transient = is_timeout(e) or self.is_transient(e)
+                if not transient:
+                    # The dependency answered, it just rejected this request.
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.max_attempts:
+                    if is_timeout(e):
+                        raise HTTPException(
+                            status_code=504, detail=f"{self.name} timed out"
+                        )
+                    raise
+            else:
+                self.breaker.record_success()
+                return result
+
+            dependency_retries.inc(self.name)
+            backoff = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+            await asyncio.sleep(random.uniform(0, backoff))
+            attempt += 1
+
+    async def attempt(self, operation: Callable[[], Awaitable[T]]) -> T:
+        tasks = {asyncio.ensure_future(self.call_once(operation))}
+        try:
+            hedge_delay = self.latencies.threshold if self.latencies else None
+            if hedge_delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    dependency_hedges.inc(self.name)
+                    tasks.add(asyncio.ensure_future(self.call_once(operation)))
+
+            error: BaseException | None = None
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def call_once(self, operation: Callable[[], Awaitable[T]]) -> T:
+        if self.admission is None:
+            return await self.call_with_deadline(operation)
+        return await self.admission.run(lambda: self.call_with_deadline(operation))
+
+    async def call_with_deadline(self, operation: Callable[[], Awaitable[T]]) -> T:
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(operation(), self.timeout)
+        except asyncio.TimeoutError:
+            dependency_calls.inc(self.name, "timeout")
+            raise
+        except Exception:
+            dependency_calls.inc(self.name, "error")
+            raise
+
+        dependency_calls.inc(self.name, "success")
+        if self.latencies is not None:
+            self.latencies.record(time.perf_counter() - started)
+        return result
@@ -0,0 +1,120 @@
+from abc import ABC, abstractmethod
+import asyncio
+from concurrent.futures import Executor
+import hashlib
+from io import BytesIO
+import os
+from pathlib import Path
+import secrets
+
+from image_analysis_api.services.resilience import RETRYABLE_STATUS_CODES
+
+
+class StorageBackend(ABC):
+    @abstractmethod
+    async def save(
+        self, name: str, data: bytes, content_type: str | None = None
+    ) -> str:
+        ...
+
+    # Where the API can read a stored image from, when it is on local disk.
+    def local_path(self, name: str) -> Path | None:
+        return None
+
+    async def close(self) -> None:
+        pass
+
+
+class AzureBlobStorageBackend(StorageBackend):
+    def __init__(self, connection_string: str, container: str = "images") -> None:
+        # The Azure SDK is slow to import, so it is only loaded once the
+        # backend is created at startup.
+        from azure.storage.blob import ContentSettings
+        from azure.storage.blob.aio import BlobServiceClient
+
+        self.content_settings = ContentSettings
+        # Retries are handled by the caller, so the SDK's own are turned off.
+        self.blob_service_client = BlobServiceClient.from_connection_string(
+            connection_string, retry_total=0
+        )
+        self.container_client = self.blob_service_client.get_container_client(container)
+
+    async def save(
+        self, name: str, data: bytes, content_type: str | None = None
+    ) -> str:
+        blob_client = self.container_client.get_blob_client(name)
+        await blob_client.upload_blob(
+            BytesIO(data),
+            overwrite=True,
+            content_settings=self.content_settings(content_type=content_type),
+        )
+        return blob_client.url
+
+    async def close(self) -> None:
+        await self.blob_service_client.close()
+
+
+def is_transient_blob_error(error: BaseException) -> bool:
+    from azure.core.exceptions import (
+        HttpResponseError,
+        ServiceRequestError,
+        ServiceResponseError,
+    )
+
+    if isinstance(error, (ServiceRequestError, ServiceResponseError)):
+        return True
+    return (
+        isinstance(error, HttpResponseError)
+        and error.status_code in RETRYABLE_STATUS_CODES
+    )
+
+
+# O_BINARY only exists on Windows, where files are opened as text without it.
+TEMP_FILE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+
+
+# Keeps images under two levels of directories named after a hash of the file
+# name, e.g. 3f/a2/image-<hash>.jpeg, so no directory grows too large.
+class LocalStorageBackend(StorageBackend):
+    def __init__(self, root: str, base_url: str | None, executor: Executor) -> None:
+        self.root = Path(root).resolve()
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.executor = executor
+
+    def relative_path(self, name: str) -> Path:
+        if Path(name).name != name or name.startswith("."):
+            raise ValueError(f"{name} is not a valid image name")
+        shard = hashlib.sha256(name.encode("utf-8")).hexdigest()
+        return Path(shard[:2], shard[2:4], name)
+
+    def local_path(self, name: str) -> Path:
+        return self.root / self.relative_path(name)
+
+    async def save(
+        self, name: str, data: bytes, content_type: str | None = None
+    ) -> str:
+        loop = asyncio.get_running_loop()
+        path = await loop.run_in_executor(self.executor, self.write_file, name, data)
+        if self.base_url is not None:
+            return f"{self.base_url}/{self.relative_path(name).as_posix()}"
+        return path.as_uri()
+
+    def write_file(self, name: str, data: bytes) -> Path:
+        path = self.local_path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Written to a temporary file first and renamed into place, so readers
+        # never see a partially written image. Unlike mkstemp, which makes the
+        # file readable only by its owner, this lets the umask set its mode.
+        temp_path = path.parent / f".{secrets.token_hex(8)}.tmp"
+        fd = os.open(temp_path, TEMP_FILE_FLAGS, 0o666)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return path
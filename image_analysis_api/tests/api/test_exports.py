@@ -0,0 +1,34 @@
+import asyncio
+from datetime import datetime, timezone
+import json
+
+from image_analysis_api.api.exports import ndjson_chunks
+
+
+class Row(dict):
+    @property
+    def _mapping(self):
+        return self
+
+
+async def rows(count: int):
+    for image_id in range(count):
+        yield Row(id=image_id, updated_at=datetime(2022, 1, 1, tzinfo=timezone.utc))
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+def test_rows_are_sent_as_lines_in_chunks():
+    chunks = asyncio.run(collect(ndjson_chunks(rows(100), chunk_size=1024)))
+    assert len(chunks) > 1
+    assert all(chunk.endswith(b"\n") for chunk in chunks)
+
+    lines = b"".join(chunks).decode("utf-8").splitlines()
+    assert [json.loads(line)["id"] for line in lines] == list(range(100))
+    assert json.loads(lines[0])["updated_at"] == "2022-01-01T00:00:00+00:00"
+
+
+def test_no_rows_sends_nothing():
+    assert asyncio.run(collect(ndjson_chunks(rows(0), chunk_size=1024))) == []
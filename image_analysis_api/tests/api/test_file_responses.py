@@ -0,0 +1,28 @@
+import pytest
+
+from image_analysis_api.api.file_responses import (
+    RangeNotSatisfiable,
+    parse_byte_range,
+)
+
+
+@pytest.mark.parametrize(
+    "range_header,expected",
+    [
+        (None, None),
+        ("bytes=0-99", (0, 99)),
+        ("bytes=100-", (100, 999)),
+        ("bytes=-100", (900, 999)),
+        ("bytes=900-2000", (900, 999)),
+        ("bytes=0-9,20-29", None),
+        ("items=0-9", None),
+        ("bytes=abc", None),
+    ],
+)
+def test_parse_byte_range(range_header, expected):
+    assert parse_byte_range(range_header, 1000) == expected
+
+
+def test_range_past_the_end_is_not_satisfiable():
+    with pytest.raises(RangeNotSatisfiable):
+        parse_byte_range("bytes=1000-", 1000)
@@ -1,10 +1,13 @@
 import base64
+import json
 import os
+import time
 from fastapi import HTTPException
 
 from fastapi.testclient import TestClient
 import pytest
 
+from image_analysis_api.api.config import get_config
 from image_analysis_api.api.main import analyze_image, app
 
 
@@ -220,3 +223,249 @@ def test_label_should_be_generated_if_not_provided(client: TestClient, image_url
     )
     resp_body = response.json()
     assert resp_body["label"] and resp_body["label"] != ""
+
+
+def test_duplicate_image_should_reuse_stored_image(
+    client: TestClient, encoded_image_string
+):
+    request_body = {
+        "label": "test",
+        "analyze_image": True,
+        "image_data": encoded_image_string.decode("utf-8"),
+    }
+    first_response = client.post("/images", json=request_body)
+    second_response = client.post("/images", json=request_body)
+    assert second_response.status_code == 200
+    first_body = first_response.json()
+    second_body = second_response.json()
+    assert second_body["id"] != first_body["id"]
+    assert second_body["url"] == first_body["url"]
+    assert second_body["objects"] == first_body["objects"]
+
+
+def test_batch_reports_results_per_item(client: TestClient, encoded_image_string):
+    response = client.post(
+        "/images/batch",
+        json={
+            "items": [
+                {
+                    "label": "test",
+                    "analyze_image": True,
+                    "image_data": encoded_image_string.decode("utf-8"),
+                },
+                {"label": "test", "image_url": "not a url"},
+            ]
+        },
+    )
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert results[0]["status_code"] == 200
+    assert "cat" in results[0]["image"]["objects"]
+    assert results[1]["status_code"] == 400
+    assert results[1]["error"] == "not a url is an invalid URL"
+
+
+def test_async_upload_returns_job_that_completes(
+    client: TestClient, encoded_image_string
+):
+    response = client.post(
+        "/images?async=true",
+        json={
+            "label": "test",
+            "analyze_image": True,
+            "image_data": encoded_image_string.decode("utf-8"),
+        },
+    )
+    assert response.status_code == 202
+    job_url = response.headers["Location"]
+    assert response.json()["status"] == "queued"
+
+    for _ in range(30):
+        job = client.get(job_url).json()
+        if job["status"] in ("succeeded", "failed"):
+            break
+        time.sleep(1)
+
+    assert job["status"] == "succeeded"
+    assert "cat" in job["image"]["objects"]
+
+
+def test_get_job_that_does_not_exist_should_fail(client: TestClient):
+    response = client.get("/jobs/9999")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Job not found"
+
+
+def test_get_images_pages_with_cursor(client: TestClient, analyzed_image_id: int):
+    first_page = client.get("/images?limit=1")
+    assert first_page.status_code == 200
+    assert len(first_page.json()) == 1
+    next_cursor = first_page.headers["X-Next-Cursor"]
+
+    second_page = client.get(f"/images?limit=1&cursor={next_cursor}")
+    assert second_page.status_code == 200
+    assert all(image["id"] < int(next_cursor) for image in second_page.json())
+
+
+def test_get_images_with_fields_only_returns_requested_fields(
+    client: TestClient, analyzed_image_id: int
+):
+    response = client.get("/images?fields=url")
+    assert response.status_code == 200
+    resp_body = response.json()
+    assert all(set(image) == {"id", "url"} for image in resp_body)
+
+
+def test_object_filter_is_case_insensitive(client: TestClient, analyzed_image_id: int):
+    response = client.get("/images?objects=CAT")
+    assert response.status_code == 200
+    assert any(image["id"] == analyzed_image_id for image in response.json())
+
+
+def test_object_filter_can_match_any_object(client: TestClient, analyzed_image_id: int):
+    response = client.get("/images?objects=cat,not-a-cat&match=any")
+    assert response.status_code == 200
+    assert any(image["id"] == analyzed_image_id for image in response.json())
+
+    response = client.get("/images?objects=cat,not-a-cat&match=all")
+    assert not any(image["id"] == analyzed_image_id for image in response.json())
+
+
+def test_get_object_counts(client: TestClient, analyzed_image_id: int):
+    response = client.get("/objects")
+    assert response.status_code == 200
+    counts = {row["object"]: row["count"] for row in response.json()}
+    assert counts["cat"] >= 1
+
+
+def test_can_upload_and_analyze_image_from_multipart_file(client: TestClient):
+    with open(os.path.join(os.path.dirname(__file__), "cats.jpg"), "rb") as f:
+        response = client.post(
+            "/images/upload",
+            data={"label": "test", "analyze_image": "true"},
+            files={"file": ("cats.jpg", f, "image/jpeg")},
+        )
+    assert response.status_code == 200
+    resp_body = response.json()
+    assert resp_body["label"] == "test"
+    assert "cat" in resp_body["objects"]
+
+
+def test_multipart_upload_must_include_file(client: TestClient):
+    response = client.post(
+        "/images/upload",
+        files={"label": (None, "test")},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Must provide an image file"
+
+
+def test_oversized_base64_image_should_fail(client: TestClient):
+    response = client.post(
+        "/images",
+        json={
+            "label": "test",
+            "image_data": "A" * (6 * 1024 * 1024),
+        },
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Image must be smaller than 4 MB"
+
+
+def test_base64_string_that_is_not_an_image_should_fail(client: TestClient):
+    response = client.post(
+        "/images",
+        json={
+            "label": "test",
+            "image_data": base64.b64encode(b"not an image").decode("utf-8"),
+        },
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "image_data is not a readable image"
+
+
+def test_uploaded_image_includes_derivative_urls(
+    client: TestClient, analyzed_image_id: int
+):
+    response = client.get(f"/images/{analyzed_image_id}")
+    assert response.status_code == 200
+    derivatives = response.json()["derivatives"]
+    assert set(derivatives) == {"thumbnail", "preview"}
+
+
+def test_get_image_by_id_with_matching_etag_returns_not_modified(
+    client: TestClient, analyzed_image_id: int
+):
+    response = client.get(f"/images/{analyzed_image_id}")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert "max-age" in response.headers["Cache-Control"]
+
+    response = client.get(
+        f"/images/{analyzed_image_id}", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+
+def test_metrics_include_stage_timings(client: TestClient, analyzed_image_id: int):
+    client.get(f"/images/{analyzed_image_id}")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/plain")
+    assert 'image_analysis_stage_duration_seconds_count{stage="db_insert"}' in (
+        response.text
+    )
+    assert 'route="get_image_by_id",status="200"' in response.text
+
+
+def test_image_content_redirects_to_blob_storage(
+    client: TestClient, analyzed_image_id: int
+):
+    image = client.get(f"/images/{analyzed_image_id}").json()
+    response = client.get(f"/images/{analyzed_image_id}/content", allow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["Location"] == image["url"]
+
+
+def test_export_streams_images_after_id_as_ndjson(
+    client: TestClient, analyzed_image_id: int, monkeypatch
+):
+    # The image was just written, so it is only exported without a settle time.
+    monkeypatch.setattr(get_config(), "export_settle_seconds", 0)
+    response = client.get(f"/images/export?id_after={analyzed_image_id - 1}")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+    images = [json.loads(line) for line in response.text.splitlines()]
+    assert images[0]["id"] == analyzed_image_id
+    assert all(image["id"] >= analyzed_image_id for image in images)
+
+
+def test_similar_images_include_copies_of_the_image(
+    client: TestClient, analyzed_image_id: int, encoded_image_string
+):
+    response = client.post(
+        "/images",
+        json={"label": "copy", "image_data": encoded_image_string.decode("utf-8")},
+    )
+    copy_id = response.json()["id"]
+
+    response = client.get(f"/images/{analyzed_image_id}/similar?max_distance=0")
+    assert response.status_code == 200
+    similar = {image["id"]: image["distance"] for image in response.json()}
+    assert similar[copy_id] == 0
+    assert analyzed_image_id not in similar
+
+
+def test_min_confidence_picks_objects_from_stored_detections(
+    client: TestClient, analyzed_image_id: int
+):
+    stored = client.get(f"/images/{analyzed_image_id}").json()["objects"]
+    params = f"objects=cat&limit=1&cursor={analyzed_image_id + 1}"
+
+    response = client.get(f"/images?{params}&min_confidence=0")
+    assert response.status_code == 200
+    assert set(stored) <= set(response.json()[0]["objects"])
+
+    response = client.get(f"/images?{params}&min_confidence=1")
+    assert response.json() == []
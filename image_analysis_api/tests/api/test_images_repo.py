@@ -0,0 +1,19 @@
+from image_analysis_api.api.images_repo import objects_above
+
+
+def test_objects_above_normalizes_labels_above_the_confidence():
+    image = {
+        "objects": ["cat"],
+        "detections": [
+            {"label": "Cat ", "confidence": 0.9},
+            {"label": "cat", "confidence": 0.7},
+            {"label": "dog", "confidence": 0.5},
+            {"label": "Mammal", "confidence": 0.6},
+        ],
+    }
+
+    assert objects_above(image, 0.5) == ["cat", "mammal"]
+
+
+def test_objects_above_keeps_objects_of_images_without_detections():
+    assert objects_above({"objects": ["cat"], "detections": None}, 0.9) == ["cat"]
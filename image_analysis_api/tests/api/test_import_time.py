@@ -0,0 +1,27 @@
+import subprocess
+import sys
+
+IMPORT_TIME_BUDGET = 1.0
+
+IMPORT_SCRIPT = """
+import sys
+import time
+
+start = time.perf_counter()
+import image_analysis_api.api.main
+
+print(time.perf_counter() - start)
+print(any(module.startswith("azure") for module in sys.modules))
+"""
+
+
+def test_import_main_is_fast() -> None:
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    import_time, azure_imported = result.stdout.split()
+    assert float(import_time) < IMPORT_TIME_BUDGET
+    assert azure_imported == "False"
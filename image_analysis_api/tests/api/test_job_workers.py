@@ -0,0 +1,59 @@
+import asyncio
+from types import SimpleNamespace
+
+from image_analysis_api.api.job_workers import JobWorkerPool
+
+JOB = {
+    "id": 1,
+    "lease_token": "token",
+    "attempts": 1,
+    "request": {"image_data": "aW1hZ2U="},
+}
+
+
+class FakeJobRepository:
+    def __init__(self, renewed: bool) -> None:
+        self.renewed = renewed
+        self.renewals = 0
+        self.completed = []
+
+    async def renew_lease(self, job_id, lease_token):
+        self.renewals += 1
+        return self.renewed
+
+    async def complete_job(self, job_id, lease_token, image_id):
+        self.completed.append((job_id, lease_token, image_id))
+        return True
+
+    async def fail_job(self, job_id, lease_token, error):
+        raise AssertionError(error)
+
+    async def requeue_job(self, job_id, lease_token):
+        raise AssertionError("requeued")
+
+
+class SlowPipeline:
+    async def ingest_image(self, request):
+        await asyncio.sleep(0.1)
+        return SimpleNamespace(id=7)
+
+
+def process(job_repo: FakeJobRepository) -> None:
+    pool = JobWorkerPool(job_repo, SlowPipeline, 1, 1, 0.03, 3)
+    asyncio.run(pool.process_job(JOB))
+
+
+def test_lease_is_renewed_while_the_job_runs():
+    job_repo = FakeJobRepository(renewed=True)
+    process(job_repo)
+
+    assert job_repo.renewals >= 2
+    assert job_repo.completed == [(1, "token", 7)]
+
+
+def test_job_stops_when_its_lease_is_lost():
+    job_repo = FakeJobRepository(renewed=False)
+    process(job_repo)
+
+    assert job_repo.renewals == 1
+    assert job_repo.completed == []
@@ -0,0 +1,77 @@
+import asyncio
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from image_analysis_api.api.similarity_index import PerceptualHashIndex
+from image_analysis_api.services.image_preprocessing_service import perceptual_hash
+
+
+def create_image(size, image_format: str, flip: bool = False) -> bytes:
+    image = Image.new("RGB", (400, 300), (40, 80, 120))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((50, 50, 200, 250), fill=(240, 200, 30))
+    draw.rectangle((250, 20, 380, 120), fill=(200, 30, 60))
+    if flip:
+        image = image.transpose(Image.FLIP_LEFT_RIGHT)
+    output = BytesIO()
+    image.resize(size).save(output, format=image_format)
+    return output.getvalue()
+
+
+def distance(first: int, second: int) -> int:
+    return bin((first ^ second) & ((1 << 64) - 1)).count("1")
+
+
+def test_resized_and_reencoded_copies_have_nearby_hashes():
+    original = perceptual_hash(create_image((400, 300), "PNG"))
+    copy = perceptual_hash(create_image((160, 120), "JPEG"))
+    other = perceptual_hash(create_image((400, 300), "PNG", flip=True))
+
+    assert -(1 << 63) <= original < 1 << 63
+    assert distance(original, copy) <= 10
+    assert distance(original, other) > 10
+
+
+def test_search_orders_by_distance_and_leaves_out_the_image():
+    index = PerceptualHashIndex(refresh_interval=60, initial_capacity=2)
+    index.add(1, 0b0000)
+    index.add(2, 0b0111)
+    index.add(3, 0b0001)
+    index.add(4, -1)
+
+    assert index.search(0, max_distance=3, limit=10, exclude_id=1) == [(3, 1), (2, 3)]
+    assert index.search(0, max_distance=64, limit=2) == [(1, 0), (3, 1)]
+
+
+def test_refresh_loads_new_images_once():
+    index = PerceptualHashIndex(refresh_interval=60)
+    index.add(2, 0)
+
+    async def load_after(image_id: int):
+        for row in [{"id": 1, "perceptual_hash": 0}, {"id": 2, "perceptual_hash": 0}]:
+            if row["id"] > image_id:
+                yield row
+
+    asyncio.run(index.refresh(load_after, force=True))
+    asyncio.run(index.refresh(load_after))
+
+    assert index.size == 2
+    assert index.search(0, max_distance=0, limit=10) == [(1, 0), (2, 0)]
+
+
+def test_refresh_loads_images_committed_out_of_order():
+    index = PerceptualHashIndex(refresh_interval=60, refresh_overlap=10)
+    committed = [{"id": 1, "perceptual_hash": 0}, {"id": 3, "perceptual_hash": 0}]
+
+    async def load_after(image_id: int):
+        for row in sorted(committed, key=lambda row: row["id"]):
+            if row["id"] > image_id:
+                yield row
+
+    asyncio.run(index.refresh(load_after, force=True))
+    committed.append({"id": 2, "perceptual_hash": 0})
+    asyncio.run(index.refresh(load_after, force=True))
+
+    assert index.size == 3
+    assert index.search(0, max_distance=0, limit=10) == [(1, 0), (2, 0), (3, 0)]
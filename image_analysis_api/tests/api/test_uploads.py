@@ -0,0 +1,92 @@
+import asyncio
+from typing import List, Tuple
+
+from fastapi import HTTPException
+import pytest
+
+from image_analysis_api.api.uploads import ImageUploadParser, upload_is_allowable_size
+
+CONTENT_TYPE = "multipart/form-data; boundary=boundary"
+
+
+def field(name: str, value: bytes) -> bytes:
+    return (
+        b"--boundary\r\n"
+        + f'Content-Disposition: form-data; name="{name}"\r\n\r\n'.encode()
+        + value
+        + b"\r\n"
+    )
+
+
+def file(name: str, data: bytes) -> bytes:
+    return (
+        b"--boundary\r\n"
+        + f'Content-Disposition: form-data; name="file"; filename="{name}"\r\n'.encode()
+        + b"Content-Type: image/png\r\n\r\n"
+        + data
+        + b"\r\n"
+    )
+
+
+def body(*parts: bytes) -> bytes:
+    return b"".join(parts) + b"--boundary--\r\n"
+
+
+def parse(data: bytes, chunk_size: int = 64 * 1024):
+    async def stream():
+        for start in range(0, len(data), chunk_size):
+            yield data[start : start + chunk_size]
+
+    return asyncio.run(ImageUploadParser(CONTENT_TYPE).parse(stream()))
+
+
+def parse_error(data: bytes) -> Tuple[int, str]:
+    with pytest.raises(HTTPException) as error:
+        parse(data)
+    return error.value.status_code, error.value.detail
+
+
+def test_fields_and_file_are_parsed_across_chunks():
+    upload = parse(
+        body(field("label", b"cats"), file("cats.png", b"image" * 100)), chunk_size=7
+    )
+
+    assert upload.fields == {"label": "cats"}
+    assert upload.filename == "cats.png"
+    assert upload.content_type == "image/png"
+    assert upload.image_bytes == b"image" * 100
+
+
+@pytest.mark.parametrize(
+    "parts, detail",
+    [
+        (
+            [file("big.png", b"x" * (4 * 1024 * 1024))],
+            "Image must be smaller than 4 MB",
+        ),
+        ([field("label", b"cats")], "Must provide an image file"),
+        (
+            [file("a.png", b"a"), file("b.png", b"b")],
+            "Only one image file can be uploaded",
+        ),
+        ([field("label", b"x" * 2000), file("a.png", b"a")], "label is too large"),
+        (
+            [field("label", b"\xff\xfe"), file("a.png", b"a")],
+            "label must be UTF-8 text",
+        ),
+    ],
+)
+def test_invalid_uploads_are_rejected(parts: List[bytes], detail: str):
+    assert parse_error(body(*parts)) == (400, detail)
+
+
+def test_body_without_closing_boundary_is_rejected():
+    assert parse_error(file("a.png", b"a")) == (400, "Request body is incomplete")
+
+
+def test_content_length_must_be_an_integer():
+    assert upload_is_allowable_size("1024")
+    assert not upload_is_allowable_size(str(5 * 1024 * 1024))
+    with pytest.raises(HTTPException) as error:
+        upload_is_allowable_size("lots")
+    assert error.value.status_code == 400
@@ -0,0 +1,31 @@
+import base64
+from io import BytesIO
+
+from fastapi import HTTPException
+from PIL import Image
+import pytest
+
+from image_analysis_api.api.validators import decode_image_data, validate_image
+
+
+def test_multi_picture_jpegs_are_accepted():
+    output = BytesIO()
+    Image.new("RGB", (60, 60)).save(
+        output, format="MPO", save_all=True, append_images=[Image.new("RGB", (60, 60))]
+    )
+
+    image = validate_image(output.getvalue(), "image/jpeg", "upload")
+
+    assert image.format == "MPO"
+
+
+def test_valid_base64_is_decoded():
+    assert decode_image_data(base64.b64encode(b"image").decode()) == b"image"
+
+
+@pytest.mark.parametrize("image_data", ["aW1h*Z2U=", "aW1hZ2U", "not base64!"])
+def test_malformed_base64_is_rejected(image_data):
+    with pytest.raises(HTTPException) as error:
+        decode_image_data(image_data)
+
+    assert error.value.status_code == 400
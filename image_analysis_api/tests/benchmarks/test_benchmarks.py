@@ -0,0 +1,40 @@
+import hashlib
+from io import BytesIO
+import json
+
+from PIL import Image
+
+from image_analysis_api.benchmarks.fakes import create_jpeg, make_unique
+from image_analysis_api.benchmarks.run import percentile, summarize
+from image_analysis_api.benchmarks.serialization import (
+    create_rows,
+    encode_rows,
+    encode_with_response_model,
+)
+
+
+def test_unique_images_are_valid_and_have_different_hashes():
+    jpeg = create_jpeg(64, 64)
+    first, second = make_unique(jpeg, 1), make_unique(jpeg, 2)
+
+    assert hashlib.sha256(first).digest() != hashlib.sha256(second).digest()
+    image = Image.open(BytesIO(second))
+    image.load()
+    assert image.size == (64, 64)
+
+
+def test_summarize_reports_nearest_rank_percentiles():
+    latencies = [i / 1000 for i in range(1, 101)]
+    result = summarize("list_images", 8, latencies, errors=2, duration=2.0)
+
+    assert result.requests == 100
+    assert result.requests_per_second == 50
+    assert (result.p50, result.p95, result.p99) == (50, 95, 99)
+    assert percentile([], 99) == 0.0
+
+
+def test_direct_encoding_matches_response_model_encoding():
+    rows = create_rows(10)
+    rows[0]["derivatives"] = None
+
+    assert json.loads(encode_rows(rows)) == json.loads(encode_with_response_model(rows))
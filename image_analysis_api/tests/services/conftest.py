@@ -0,0 +1,27 @@
+import pytest
+
+from image_analysis_api.services.resilience import ResilientCaller
+
+
+class TransientError(Exception):
+    pass
+
+
+def is_transient(error: BaseException) -> bool:
+    return isinstance(error, TransientError)
+
+
+@pytest.fixture
+def caller() -> ResilientCaller:
+    return ResilientCaller(
+        "test",
+        timeout=0.2,
+        max_attempts=3,
+        backoff_base=0.001,
+        backoff_max=0.01,
+        hedge_percentile=None,
+        hedge_min_samples=1,
+        circuit_failure_threshold=5,
+        circuit_reset_timeout=30,
+        is_transient=is_transient,
+    )
@@ -0,0 +1,129 @@
+import asyncio
+
+from fastapi import HTTPException
+import pytest
+
+from image_analysis_api.services.admission import (
+    AdmissionController,
+    AIMDLimiter,
+    InMemoryTokenBucket,
+)
+from image_analysis_api.services.resilience import ResilientCaller
+
+
+class OverloadError(Exception):
+    pass
+
+
+def is_overload(error: BaseException) -> bool:
+    return isinstance(error, OverloadError)
+
+
+@pytest.fixture
+def limiter() -> AIMDLimiter:
+    return AIMDLimiter(initial_limit=8, min_limit=1, max_limit=10, latency_tolerance=2)
+
+
+def test_calls_over_the_rate_are_rejected_with_retry_after(limiter: AIMDLimiter):
+    bucket = InMemoryTokenBucket(rate=0.5, burst=2)
+    controller = AdmissionController(limiter, bucket, 0.05, is_overload)
+
+    async def call():
+        return "ok"
+
+    async def run():
+        assert await controller.run(call) == "ok"
+        assert await controller.run(call) == "ok"
+        await controller.run(call)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(run())
+    assert error.value.status_code == 503
+    assert error.value.headers["Retry-After"] == "2"
+
+
+def test_calls_over_the_limit_wait_for_a_free_slot():
+    limiter = AIMDLimiter(
+        initial_limit=2, min_limit=1, max_limit=2, latency_tolerance=2
+    )
+    controller = AdmissionController(limiter, None, 1, is_overload)
+    running = []
+
+    async def call():
+        running.append(1)
+        assert len(running) <= 2
+        await asyncio.sleep(0.01)
+        running.pop()
+
+    async def run():
+        await asyncio.gather(*(controller.run(call) for _ in range(6)))
+
+    asyncio.run(run())
+    assert limiter.in_flight == 0
+
+
+def test_calls_rejected_for_concurrency_take_no_token():
+    limiter = AIMDLimiter(
+        initial_limit=1, min_limit=1, max_limit=1, latency_tolerance=2
+    )
+    bucket = InMemoryTokenBucket(rate=0.001, burst=10)
+    controller = AdmissionController(limiter, bucket, 0.05, is_overload)
+
+    async def slow():
+        await asyncio.sleep(0.2)
+
+    async def run():
+        await asyncio.gather(controller.run(slow), controller.run(slow))
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(run())
+    assert error.value.status_code == 503
+    assert bucket.tokens == pytest.approx(9, abs=0.01)
+
+
+def test_overload_halves_the_limit(limiter: AIMDLimiter):
+    controller = AdmissionController(limiter, None, 1, is_overload)
+
+    async def overloaded():
+        raise OverloadError()
+
+    with pytest.raises(OverloadError):
+        asyncio.run(controller.run(overloaded))
+    assert limiter.limit == 4
+
+
+def test_every_retried_attempt_takes_a_token(
+    caller: ResilientCaller, limiter: AIMDLimiter
+):
+    bucket = InMemoryTokenBucket(rate=0.001, burst=10)
+    caller.is_transient = is_overload
+    caller.admission = AdmissionController(limiter, bucket, 0.05, is_overload)
+    attempts = []
+
+    async def overloaded():
+        attempts.append(1)
+        raise OverloadError()
+
+    with pytest.raises(OverloadError):
+        asyncio.run(caller.call(overloaded))
+    assert len(attempts) == 3
+    assert bucket.tokens == pytest.approx(7, abs=0.01)
+    assert limiter.limit == 1
+
+
+def test_rejected_retries_are_not_sent(caller: ResilientCaller, limiter: AIMDLimiter):
+    caller.is_transient = is_overload
+    caller.admission = AdmissionController(
+        limiter, InMemoryTokenBucket(rate=0.001, burst=1), 0.05, is_overload
+    )
+    attempts = []
+
+    async def overloaded():
+        attempts.append(1)
+        raise OverloadError()
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(caller.call(overloaded))
+    assert error.value.status_code == 503
+    assert len(attempts) == 1
+    assert caller.breaker.failures == 1
@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from image_analysis_api.services.image_preprocessing_service import (
+    ImagePreprocessingService,
+    downscale_image,
+)
+
+
+@pytest.fixture
+def service():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        yield ImagePreprocessingService(
+            max_dimension=1024, jpeg_quality=85, executor=executor
+        )
+
+
+def encode(image: Image.Image, image_format: str, **params) -> bytes:
+    output = BytesIO()
+    image.save(output, format=image_format, **params)
+    return output.getvalue()
+
+
+def decode(image_bytes: bytes) -> Image.Image:
+    image = Image.open(BytesIO(image_bytes))
+    image.load()
+    return image
+
+
+@pytest.mark.parametrize(
+    "size, downscale",
+    [
+        ((1024, 768), False),
+        ((4000, 3000), True),
+        ((3000, 4000), True),
+        # The short side would end up below the Computer Vision minimum.
+        ((4000, 100), False),
+    ],
+)
+def test_should_downscale(service, size, downscale):
+    assert service.should_downscale(Image.new("RGB", size)) == downscale
+
+
+def test_should_downscale_is_disabled_by_zero_max_dimension():
+    service = ImagePreprocessingService(max_dimension=0, jpeg_quality=85, executor=None)
+
+    assert not service.should_downscale(Image.new("RGB", (8000, 6000)))
+
+
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG", "GIF"])
+def test_downscale_image_fits_max_dimension(image_format):
+    image_bytes = encode(Image.new("RGB", (3000, 2000), "red"), image_format)
+
+    downscaled = decode(downscale_image(image_bytes, 1024, 85))
+
+    assert downscaled.format == "JPEG"
+    assert downscaled.mode == "RGB"
+    assert downscaled.size == (1024, 683)
+
+
+def test_downscale_image_keeps_palette_colors():
+    image = Image.new("RGB", (2048, 2048), "blue").convert("P")
+
+    downscaled = decode(downscale_image(encode(image, "PNG"), 1024, 85))
+
+    red, green, blue = downscaled.getpixel((512, 512))
+    assert red < 10 and green < 10 and blue > 245
+
+
+# Orientation 6 means the camera was turned, so viewers rotate the image 90°.
+def test_downscale_image_rotates_upright():
+    image = Image.new("RGB", (4000, 2000), "red")
+    exif = image.getexif()
+    exif[0x0112] = 6
+
+    downscaled = decode(downscale_image(encode(image, "JPEG", exif=exif), 1024, 85))
+
+    assert downscaled.size == (512, 1024)
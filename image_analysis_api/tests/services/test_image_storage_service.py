@@ -0,0 +1,38 @@
+from io import BytesIO
+
+from PIL import Image
+import pytest
+
+from image_analysis_api.services.image_storage_service import generate_derivatives
+
+
+# Orientation 6 means the camera was turned, so viewers rotate the image 90°.
+def rotated_photo() -> bytes:
+    image = Image.new("RGB", (400, 200), "red")
+    exif = image.getexif()
+    exif[0x0112] = 6
+    output = BytesIO()
+    image.save(output, format="JPEG", exif=exif)
+    return output.getvalue()
+
+
+def test_derivatives_are_rotated_upright():
+    derivatives, _ = generate_derivatives(
+        rotated_photo(), {"small": 100, "medium": 200}, "jpeg", 80
+    )
+
+    sizes = {name: Image.open(BytesIO(data)).size for name, data in derivatives.items()}
+    assert sizes == {"small": (50, 100), "medium": (100, 200)}
+
+
+@pytest.mark.parametrize(
+    "mode, color, derivative_mode",
+    [("RGB", "red", "RGB"), ("RGBA", (255, 0, 0, 128), "RGBA")],
+)
+def test_only_transparent_images_get_alpha(mode, color, derivative_mode):
+    output = BytesIO()
+    Image.new(mode, (400, 200), color).save(output, format="PNG")
+
+    derivatives, _ = generate_derivatives(output.getvalue(), {"small": 100}, "webp", 80)
+
+    assert Image.open(BytesIO(derivatives["small"])).mode == derivative_mode
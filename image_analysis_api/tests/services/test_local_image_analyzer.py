@@ -0,0 +1,104 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from io import BytesIO
+from typing import Any, List
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+from image_analysis_api.services.local_image_analyzer import (
+    LocalImageAnalyzer,
+    inference_batch_size,
+    load_model,
+)
+
+onnx = pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+
+# A model that scores each label by how much of its color channel the image has.
+@pytest.fixture(scope="module")
+def model_files(tmp_path_factory):
+    from onnx import TensorProto, helper
+
+    graph = helper.make_graph(
+        [
+            helper.make_node(
+                "ReduceMean", ["images"], ["means"], axes=[2, 3], keepdims=0
+            ),
+            helper.make_node("Sigmoid", ["means"], ["scores"]),
+        ],
+        "channel-colors",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, [None, 3, 8, 8])],
+        [helper.make_tensor_value_info("scores", TensorProto.FLOAT, [None, 3])],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+
+    directory = tmp_path_factory.mktemp("model")
+    onnx.save(model, str(directory / "model.onnx"))
+    (directory / "labels.txt").write_text("red\ngreen\nblue\n")
+    return str(directory / "model.onnx"), str(directory / "labels.txt")
+
+
+def inference_calls() -> int:
+    counts, _ = inference_batch_size.values.get((), ([], []))
+    return sum(counts)
+
+
+def image_bytes(color: str, image_format: str = "PNG") -> bytes:
+    output = BytesIO()
+    Image.new("RGB", (64, 64), color).save(output, format=image_format)
+    return output.getvalue()
+
+
+def detect_all(model_files, images: List[bytes]) -> List[Any]:
+    async def detect():
+        with ProcessPoolExecutor(
+            max_workers=1, initializer=load_model, initargs=model_files
+        ) as executor:
+            analyzer = LocalImageAnalyzer(
+                input_size=8,
+                batch_max_size=len(images),
+                batch_max_wait=0.5,
+                max_concurrent_batches=1,
+                executor=executor,
+            )
+            try:
+                return await asyncio.gather(
+                    *(
+                        analyzer.detect_objects(image, Decimal("0.5"))
+                        for image in images
+                    ),
+                    return_exceptions=True,
+                )
+            finally:
+                analyzer.close()
+
+    return asyncio.run(detect())
+
+
+def test_concurrent_requests_share_one_batch(model_files):
+    calls = inference_calls()
+    detections = detect_all(
+        model_files,
+        [image_bytes(color) for color in ["red", "green", "blue", "yellow"]],
+    )
+
+    objects = [[detection.label for detection in image] for image in detections]
+    assert objects == [["red"], ["green"], ["blue"], ["green", "red"]]
+    assert all(0.5 < detection.confidence < 1 for detection in detections[3])
+    assert inference_calls() == calls + 1
+
+
+def test_undecodable_image_fails_alone(model_files):
+    truncated = image_bytes("blue", "JPEG")[:200]
+    calls = inference_calls()
+    red, broken = detect_all(model_files, [image_bytes("red"), truncated])
+
+    assert [detection.label for detection in red] == ["red"]
+    assert isinstance(broken, HTTPException)
+    assert broken.status_code == 400
+    assert inference_calls() == calls + 1
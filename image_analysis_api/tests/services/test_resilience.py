@@ -0,0 +1,88 @@
+import asyncio
+
+from fastapi import HTTPException
+import pytest
+
+from image_analysis_api.services.resilience import (
+    OPEN,
+    LatencyTracker,
+    ResilientCaller,
+    dependency_hedges,
+)
+from image_analysis_api.tests.services.conftest import TransientError
+
+
+def test_transient_errors_are_retried(caller: ResilientCaller):
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise TransientError()
+        return "ok"
+
+    assert asyncio.run(caller.call(flaky)) == "ok"
+    assert len(calls) == 3
+
+
+def test_other_errors_are_not_retried(caller: ResilientCaller):
+    calls = []
+
+    async def invalid():
+        calls.append(1)
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        asyncio.run(caller.call(invalid))
+    assert len(calls) == 1
+
+
+def test_calls_past_the_deadline_time_out(caller: ResilientCaller):
+    caller.timeout = 0.01
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(caller.call(slow))
+    assert e.value.status_code == 504
+
+
+def test_circuit_opens_after_repeated_failures(caller: ResilientCaller):
+    caller.max_attempts = 1
+    caller.breaker.failure_threshold = 2
+
+    async def failing():
+        raise TransientError()
+
+    async def call_three_times():
+        for _ in range(2):
+            with pytest.raises(TransientError):
+                await caller.call(failing)
+        with pytest.raises(HTTPException) as e:
+            await caller.call(failing)
+        return e.value
+
+    error = asyncio.run(call_three_times())
+    assert caller.breaker.state == OPEN
+    assert error.status_code == 503
+    assert error.headers["Retry-After"] == "30"
+
+
+def test_slow_calls_are_hedged(caller: ResilientCaller):
+    caller.timeout = 1
+    caller.max_attempts = 1
+    caller.latencies = LatencyTracker(percentile=50, min_samples=1)
+    delays = [0.01, 0.5, 0.01]
+
+    async def call():
+        await asyncio.sleep(delays.pop(0))
+        return "ok"
+
+    async def call_twice():
+        await caller.call(call)
+        return await caller.call(call)
+
+    hedges = dependency_hedges.values.get(("test",), 0)
+    assert asyncio.run(call_twice()) == "ok"
+    assert dependency_hedges.values[("test",)] == hedges + 1
@@ -0,0 +1,19 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from image_analysis_api.services.storage_backends import LocalStorageBackend
+
+
+def test_saved_files_get_the_default_file_mode(tmp_path):
+    umask = os.umask(0o022)
+    try:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            backend = LocalStorageBackend(str(tmp_path), None, executor)
+            asyncio.run(backend.save("image.png", b"image"))
+    finally:
+        os.umask(umask)
+
+    path = backend.local_path("image.png")
+    assert path.read_bytes() == b"image"
+    assert path.stat().st_mode & 0o777 == 0o644